@@ -1,4 +1,4 @@
-from dpic_takehome.dashboard import app
+from dpic_takehome.dashboard import app, data
 from dpic_takehome.data_pipeline import cleaning, data_to_db
 import webbrowser
 from threading import Timer
@@ -6,9 +6,13 @@ from threading import Timer
 def open_browser():
     webbrowser.open_new("http://localhost:8050")
 
-if __name__ == "__main__":
+def prepare_data():
     cleaning.main()
     data_to_db.main()
-    app.app.run(debug=False)
+
+if __name__ == "__main__":
+    # The server binds right away; the pipeline and the queries run in the
+    # background while the page shows a loading message.
+    data.start_warm_up(prepare_data)
     Timer(1, open_browser).start()
-    app.app.run(debug=False, port = '8050')
\ No newline at end of file
+    app.app.run(debug=False, port = '8050')
@@ -1,13 +1,43 @@
 from airflow import DAG
 from airflow.operators.python import PythonOperator
-import datetime
-from data_pipeline import fetch_data, cleaning, data_to_db
+from airflow.utils.task_group import TaskGroup
+from datetime import datetime
+from dpic_takehome.data_pipeline import fetch_data, partitions
+from dpic_takehome import metrics
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-def send_summary_email():
-    summary = "Weekly pipeline run completed. \n New rows added: 300. \n Dashboard updated."
+SOURCES = ["grievances", "iti_enrollments"]
+# Schema mode of every task of the run (see cleaning.compact_frame)
+COMPACT = False
+
+def plan_source(source):
+    # One mapped task per year touched by the new raw drop
+    plan = partitions.plan(source, compact=COMPACT)
+    return [{"stage": source, "year": year, "compact": COMPACT} for year in plan["years"]]
+
+def commit_delta():
+    return partitions.commit(SOURCES, compact=COMPACT)
+
+def format_summary(downloads: dict, result: dict, top: int = 5) -> str:
+    lines = ["Weekly pipeline run completed."]
+    lines += [f" {path}: {status}." for path, status in downloads.items()]
+    for source, counts in result["sources"].items():
+        lines.append(f" {source}: {counts['new']} new, {counts['changed']} changed, "
+                     f"{counts['deleted']} deleted records.")
+    lines.append(" Slowest stages:")
+    for r in sorted(result["stages"], key=lambda r: r["seconds"], reverse=True)[:top]:
+        lines.append(f"  {r['name']}: {r['seconds']:.2f}s, {r['rows_in']} rows in, "
+                     f"{r['rows_out']} rows out, peak memory {r['peak_rss_mb']} MB")
+    lines.append(" Dashboard updated.")
+    return "\n".join(lines)
+
+def send_summary_email(ti, dag_run):
+    # Every task appends its stages to the same metrics file
+    stages = [r for r in metrics.read_jsonl() if r["finished_at"] >= dag_run.start_date.timestamp()]
+    result = {"sources": ti.xcom_pull(task_ids="commit_delta"), "stages": stages}
+    summary = format_summary(ti.xcom_pull(task_ids="fetch_raw_data"), result)
 
     sender = "sender@example.com"
     message = MIMEMultipart()
@@ -40,14 +70,41 @@ with DAG(
         python_callable=fetch_data.main,
     )
 
-    clean_task = PythonOperator(
-        task_id="clean_data",
-        python_callable=cleaning.main,
+    # Creates missing tables and stores the districts every year refers to
+    prepare_task = PythonOperator(
+        task_id="prepare_database",
+        python_callable=partitions.prepare,
+        op_kwargs={"compact": COMPACT},
     )
 
-    load_db_task = PythonOperator(
-        task_id="load_db_data",
-        python_callable=data_to_db.main,
+    # One branch per source: plan the delta, then clean and load each touched
+    # year as its own mapped task, so years run on as many workers as there
+    # are and a failed year is retried alone. Loads replace the whole year and
+    # refresh only the summary partitions it touched, so reruns are harmless.
+    branches = []
+    for source in SOURCES:
+        with TaskGroup(group_id=source) as branch:
+            plan_task = PythonOperator(
+                task_id="plan",
+                python_callable=plan_source,
+                op_kwargs={"source": source},
+            )
+            clean_tasks = PythonOperator.partial(
+                task_id="clean_year",
+                python_callable=partitions.clean_year,
+            ).expand(op_kwargs=plan_task.output)
+            load_tasks = PythonOperator.partial(
+                task_id="load_year",
+                python_callable=partitions.load_year,
+            ).expand(op_kwargs=clean_tasks.output)
+            plan_task >> clean_tasks >> load_tasks
+        branches.append(branch)
+
+    # Runs when a source had no touched years (its mapped tasks are skipped)
+    commit_task = PythonOperator(
+        task_id="commit_delta",
+        python_callable=commit_delta,
+        trigger_rule="none_failed",
     )
 
     email_task = PythonOperator(
@@ -55,4 +112,4 @@ with DAG(
         python_callable=send_summary_email,
     )
 
-    fetch_task >> clean_task >> load_db_task >> email_task
+    fetch_task >> prepare_task >> branches >> commit_task >> email_task
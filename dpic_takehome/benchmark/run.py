@@ -0,0 +1,185 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from . import synthetic
+from .. import metrics
+
+PATH_RESULTS = Path("data/benchmarks/results.json")
+PATH_WORK = Path("data/benchmarks/work")
+PATH_SQL = Path(__file__).resolve().parent.parent / "sql"
+SCALES = [1, 10]
+TOLERANCE = 0.25
+
+
+@contextmanager
+def measure():
+    '''
+    Context manager to measure a stage starting from a collected heap, so
+    garbage left by the previous stage does not count against it
+    '''
+    gc.collect()
+    with metrics.measure() as result:
+        yield result
+
+
+@contextmanager
+def work_dir(path: Path):
+    '''
+    Context manager to run the pipeline in a directory laid out like the
+    repository (data/raw, data/clean, dpic_takehome/sql), so the relative
+    paths used by the pipeline point to the synthetic data
+    '''
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "dpic_takehome").mkdir(exist_ok=True)
+    if not (path / "dpic_takehome" / "sql").exists():
+        os.symlink(PATH_SQL, path / "dpic_takehome" / "sql")
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
+
+
+def run_scale(scale: float, seed: int = 0, keep: bool = False, compact: bool = False) -> list:
+    '''
+    Function to generate a synthetic dataset and time each stage of the
+    pipeline on it: cleaning of each source, loading into the database,
+    dashboard queries and rendering of the charts for every selection
+
+    Args:
+        - scale: size relative to the sample
+        - seed: seed of the synthetic data
+        - keep: keep the generated files and database
+        - compact: run the pipeline with the compact schema
+
+    Returns: list of dicts, one per stage
+    '''
+    from ..data_pipeline import cleaning, data_to_db, run_queries
+    from ..dashboard import app, data as dashboard_data
+    from ..dashboard.figure_cache import clear_figures
+
+    names = cleaning.get_official_names()
+    sample_dir = synthetic.PATH_SAMPLE.resolve()
+    path = PATH_WORK.resolve() / f"scale_{scale:g}"
+    shutil.rmtree(path, ignore_errors=True)
+    records = []
+
+    def record(stage, metrics, rows_in, rows_out):
+        records.append({"scale": scale, "stage": stage, "rows_in": rows_in, "rows_out": rows_out, **metrics})
+        print(f"{scale:>6g}x {stage:<22} {metrics['seconds']:>9.3f}s {metrics['peak_rss_mb']:>9.1f}MB")
+
+    with work_dir(path):
+        n_raw = synthetic.generate(scale, Path("data/raw"), seed, sample_dir)
+        cleaning.write_names_snapshot(names)
+
+        with measure() as m:
+            df = cleaning.clean_grievances(cleaning.STAGE_RAW["grievances"], compact=compact)
+        record("clean_grievances", m, n_raw["grievances"], len(df))
+
+        with measure() as m:
+            df = cleaning.clean_iti_enrollments(cleaning.STAGE_RAW["iti_enrollments"], compact=compact)
+        record("clean_iti_enrollments", m, n_raw["iti_enrollments"], len(df))
+        del df
+
+        # The clean layer is built outside the timings, so data_to_db.main
+        # only pays for loading (its own cleaning.main call finds it current)
+        cleaning.main(compact=compact)
+        n_clean = sum(len(cleaning.read_clean(table)) for table in cleaning.STAGE_VERSIONS)
+        with measure() as m:
+            data_to_db.main(compact=compact)
+        record("data_to_db.main", m, n_clean, n_clean)
+
+        with measure() as m:
+            results = run_queries.run_queries()
+        record("run_queries", m, len(results), sum(len(df) for df in results.values()))
+
+        dashboard_data.reload()
+        clear_figures()
+        selections = [(year, district) for year in app.YEARS
+                      for district in dashboard_data.current()["districts"]]
+        with measure() as m:
+            for year, district in selections:
+                app.update_charts(year, district)
+        record("update_charts", m, len(selections), len(selections) * 9)
+
+    if not keep:
+        shutil.rmtree(path, ignore_errors=True)
+    return records
+
+
+def environment(compact: bool = False) -> dict:
+    '''
+    Helper function to describe where the benchmark ran, to compare results
+    only between similar runs
+    '''
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "compact_schema": compact,
+        "created_at": time.time(),
+    }
+
+
+def compare(results: list, baseline: list, tolerance: float = TOLERANCE) -> list:
+    '''
+    Function to find the stages that got slower than the baseline by more than
+    `tolerance` (e.g. 0.25 = 25%)
+
+    Returns: list of messages, one per regression
+    '''
+    previous = {(r["scale"], r["stage"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r["scale"], r["stage"]))
+        if old and r["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append(f"{r['stage']} at {r['scale']:g}x: {old['seconds']:.3f}s -> {r['seconds']:.3f}s")
+    return regressions
+
+
+def main(scales: list = SCALES, out: Path = PATH_RESULTS, seed: int = 0, keep: bool = False,
+         compact: bool = False) -> list:
+    '''
+    Function to run the benchmark at each scale and write the results as JSON
+
+    Returns: list of dicts, one per scale and stage
+    '''
+    results = [r for scale in scales for r in run_scale(scale, seed, keep, compact)]
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"environment": environment(compact), "results": results}, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data")
+    parser.add_argument("--scales", type=float, nargs="+", default=SCALES, help="e.g. 1 10 100 1000")
+    parser.add_argument("--out", type=Path, default=PATH_RESULTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the generated data")
+    parser.add_argument("--compact", action="store_true", help="use the compact schema")
+    parser.add_argument("--compare", type=Path, help="previous results file; exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = main(args.scales, args.out, args.seed, args.keep, args.compact)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            print(f"Regression: {message}")
+        sys.exit(1 if regressions else 0)
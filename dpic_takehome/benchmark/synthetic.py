@@ -0,0 +1,166 @@
+import math
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+PATH_SAMPLE = Path("data/raw")
+SAMPLE_ROWS = {"grievances": 8_000, "iti_enrollments": 20_000}
+DATE_FORMATS = ["%d/%m/%Y", "%Y-%m-%d", "%b %d, %Y"]
+TYPO_RATE = 0.02
+DUPLICATE_RATE = 0.01
+CHUNK_ROWS = 200_000
+
+
+def read_sample(sample_dir: Path = PATH_SAMPLE) -> dict:
+    '''
+    Helper function to read the real raw files, used as the source of the
+    values (and of their messiness) of the synthetic data
+
+    Returns: dict with the raw grievances and enrollments
+    '''
+    grievances = pd.read_json(sample_dir / "grievances.json", convert_dates=False)
+    enrollments = pd.read_csv(sample_dir / "iti_enrollments.csv", dtype={"enrolled": str})
+    return {"grievances": grievances, "iti_enrollments": enrollments}
+
+
+def scaled_vocab(values: pd.Series, scale: float) -> np.ndarray:
+    '''
+    Helper function to grow a vocabulary with the scale (e.g. "Barabati ITI",
+    "Barabati ITI 1", ...), so larger datasets also have more distinct keys
+    instead of only more duplicates
+    '''
+    base = values.dropna().unique()
+    copies = max(1, math.ceil(scale))
+    return np.array([name if k == 0 else f"{name} {k}" for k in range(copies) for name in base], dtype=object)
+
+
+def add_typos(rng: np.random.Generator, values: np.ndarray, rate: float = TYPO_RATE) -> np.ndarray:
+    '''
+    Helper function to misspell a share of the values by dropping, doubling
+    or swapping one character, on top of the misspellings of the sample
+    '''
+    values = values.copy()
+    for ix in np.flatnonzero(rng.random(len(values)) < rate):
+        text = values[ix]
+        if not isinstance(text, str) or len(text) < 3:
+            continue
+        pos = rng.integers(1, len(text) - 1)
+        edit = rng.integers(3)
+        if edit == 0:
+            values[ix] = text[:pos] + text[pos + 1:]
+        elif edit == 1:
+            values[ix] = text[:pos] + text[pos] + text[pos:]
+        else:
+            values[ix] = text[:pos - 1] + text[pos] + text[pos - 1] + text[pos + 1:]
+    return values
+
+
+def random_dates(rng: np.random.Generator, n: int, start: pd.Timestamp, end: pd.Timestamp) -> np.ndarray:
+    '''
+    Helper function to draw dates between start and end, each written in one
+    of the formats found in the sample
+    '''
+    days = rng.integers(0, (end - start).days + 1, n)
+    dates = start + pd.to_timedelta(days, unit="D")
+    formats = rng.integers(len(DATE_FORMATS), size=n)
+    out = np.empty(n, dtype=object)
+    for k, fmt in enumerate(DATE_FORMATS):
+        out[formats == k] = dates[formats == k].strftime(fmt)
+    return out
+
+
+def add_duplicates(rng: np.random.Generator, df: pd.DataFrame, rate: float = DUPLICATE_RATE) -> pd.DataFrame:
+    '''
+    Helper function to repeat a share of the records as exact duplicates
+    '''
+    repeated = df.iloc[rng.integers(len(df), size=int(len(df) * rate))]
+    return pd.concat([df, repeated], ignore_index=True)
+
+
+def gen_grievances(rng: np.random.Generator, sample: pd.DataFrame, n: int, scale: float) -> pd.DataFrame:
+    '''
+    Function to draw n synthetic complaints. Columns are drawn independently
+    from the sample, so null shares of resolved and submitted_by are kept.
+    '''
+    dates = pd.to_datetime(sample["submission_date"], format="mixed")
+    submitters = scaled_vocab(sample["submitted_by"], scale)
+    resolved = sample["resolved"].map({0: False, 1: True}).astype(object)
+
+    df = pd.DataFrame({
+        "district_name": add_typos(rng, rng.choice(sample["district_name"].to_numpy(), n)),
+        "submission_date": random_dates(rng, n, dates.min(), dates.max()),
+        "grievance_text": rng.choice(sample["grievance_text"].to_numpy(), n),
+        "resolved": rng.choice(resolved.to_numpy(), n),
+        "submitted_by": rng.choice(submitters, n),
+    })
+    df.loc[rng.random(n) < sample["submitted_by"].isna().mean(), "submitted_by"] = None
+    return add_duplicates(rng, df)
+
+
+def gen_iti_enrollments(rng: np.random.Generator, sample: pd.DataFrame, n: int, scale: float) -> pd.DataFrame:
+    '''
+    Function to draw n synthetic enrollment rows. enrolled keeps the mix of
+    numbers, '--' and empty values of the sample.
+    '''
+    df = pd.DataFrame({
+        "district": add_typos(rng, rng.choice(sample["district"].to_numpy(), n)),
+        "year": rng.choice(sample["year"].to_numpy(), n),
+        "institute_id": [f"{x:032x}" for x in rng.integers(0, 2**63, n)],
+        "institute_name": rng.choice(scaled_vocab(sample["institute_name"], scale), n),
+        "program": rng.choice(sample["program"].to_numpy(), n),
+        "gender": rng.choice(sample["gender"].to_numpy(), n),
+        "enrolled": rng.choice(sample["enrolled"].to_numpy(), n),
+    })
+    return add_duplicates(rng, df)
+
+
+def generate(scale: float, out_dir: Path, seed: int = 0, sample_dir: Path = PATH_SAMPLE,
+             chunk_rows: int = CHUNK_ROWS) -> dict:
+    '''
+    Function to write grievances.json and iti_enrollments.csv with `scale`
+    times the rows of the sample. Files are written in chunks, so memory does
+    not grow with the scale.
+
+    Args:
+        - scale: size relative to the sample (1 = 8k complaints, 20k enrollments)
+        - out_dir: Path object of the directory where the files are written
+        - seed: seed of the random generator
+        - sample_dir: Path object of the real raw files
+        - chunk_rows: number of rows generated at a time
+
+    Returns: dict with the number of records written to each file
+    '''
+    rng = np.random.default_rng(seed)
+    sample = read_sample(sample_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    n_rows = {}
+
+    total = int(SAMPLE_ROWS["grievances"] * scale)
+    n_rows["grievances"] = 0
+    with open(out_dir / "grievances.json", "w") as f:
+        f.write("[\n")
+        for start in range(0, total, chunk_rows):
+            chunk = gen_grievances(rng, sample["grievances"], min(chunk_rows, total - start), scale)
+            f.write(",\n" if start else "")
+            f.write(chunk.to_json(orient="records")[1:-1].replace("},{", "},\n{"))
+            n_rows["grievances"] += len(chunk)
+        f.write("\n]\n")
+
+    total = int(SAMPLE_ROWS["iti_enrollments"] * scale)
+    n_rows["iti_enrollments"] = 0
+    for start in range(0, total, chunk_rows):
+        chunk = gen_iti_enrollments(rng, sample["iti_enrollments"], min(chunk_rows, total - start), scale)
+        chunk.to_csv(out_dir / "iti_enrollments.csv", index=False, header=not start, mode="a" if start else "w")
+        n_rows["iti_enrollments"] += len(chunk)
+
+    return n_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic raw files")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--out", type=Path, default=Path("data/benchmarks/raw"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate(args.scale, args.out, args.seed))
@@ -1,19 +1,28 @@
-from dash import Dash, html, dcc, Input, Output, callback
+import time
+from dash import Dash, html, dcc, Input, Output, State, callback, no_update
+from dash.exceptions import PreventUpdate
+from flask import jsonify, request, g
 import dash_bootstrap_components as dbc
-from ..data_pipeline.run_queries import run_queries
-from .figures import gen_bar_chart_by, create_interactive_bar, create_scatter, gen_bar_chart
+import dash_vega_components as dvc
+from . import data as dashboard_data
+from .figure_cache import cached_figure
+from .cube import lookup
+from .. import metrics
 
 app = Dash(external_stylesheets=[dbc.themes.BOOTSTRAP])
 
-tables = list(run_queries().values())
+YEARS = list(range(2020,2025))
+LOADING_POLL_MS = 500
+RELOAD_POLL_MS = 60_000
+DEFAULT_DISTRICT = 'Bhubaneswar'
 
 district_dropdown = html.Div(
     [
         dbc.Label("Select a District", html_for="district_dropdown"),
         dcc.Dropdown(
             id="district-dropdown",
-            options=sorted(tables[-1]["district"].unique()),
-            value='Bhubaneswar',
+            options=[DEFAULT_DISTRICT],
+            value=DEFAULT_DISTRICT,
             clearable=False,
             maxHeight=600,
             optionHeight=50
@@ -26,7 +35,7 @@ year_dropdown = html.Div(
         dbc.Label("Select Year", html_for="date-checklist"),
         dcc.Dropdown(
             id = "year-dropdown",
-            options=list(range(2020,2025)),
+            options=YEARS,
             value=2024,
         ),
     ],
@@ -99,45 +108,119 @@ text_2 = html.Div([
     ])
 ], style={'margin': '20px', 'fontFamily': 'Arial', 'fontSize': '15px'})
 
-app.layout = dbc.Container(
-    [
-        heading,
-        dbc.Row([
-            dbc.Col(info, md=3),
-            dbc.Col([
-                html.H2("Summary of Odisha's Enrollment and Grievances"),
-                text_1,
-                dbc.Row([
-                    dbc.Col(html.Div(id="enrollment-gender")),
-                    dbc.Col(html.Div(id="grievances-cat"))
-                    ]),
-                html.Div(text_2),
-                dbc.Row([dbc.Col(html.Div(id="grievances-pc")),
-                         dbc.Col(html.Div(id="scatter-graph"))])
+def serve_layout():
+    '''
+    Function to build the page. It does not need the data: while it loads,
+    the page shows a loading message and polls until the data is ready. Then
+    it keeps polling slowly to pick up reloads of the database.
+    '''
+    loading = None
+    if dashboard_data.status()["status"] != "ready":
+        loading = dbc.Alert("Loading data, the charts will appear in a moment.", color="info")
+
+    return dbc.Container(
+        [
+            dcc.Interval(id="data-poll", interval=LOADING_POLL_MS),
+            dcc.Store(id="data-version"),
+            heading,
+            html.Div(loading, id="data-status"),
+            dbc.Row([
+                dbc.Col(info, md=3),
+                dbc.Col([
+                    html.H2("Summary of Odisha's Enrollment and Grievances"),
+                    text_1,
+                    dbc.Row([
+                        dbc.Col(html.Div(id="enrollment-gender")),
+                        dbc.Col(html.Div(id="grievances-cat"))
+                        ]),
+                    html.Div(text_2),
+                    dbc.Row([dbc.Col(html.Div(id="grievances-pc")),
+                             dbc.Col(html.Div(id="scatter-graph"))])
+                ]),
             ]),
-        ]),
-        dbc.Row([dbc.Col(control_panel, md=3),
-                 dbc.Col([
-                     html.H2(id="title-2"),
-                     dbc.Row([dbc.Col(html.Div(id="enrollment-card")), dbc.Col(html.Div(id="grievances-card"))]),
-                     dbc.Row([dbc.Col(html.Div(id="evol-enrollment")), dbc.Col(html.Div(id="grievances-enrollment"))]),
-                     dbc.Row([dbc.Col(html.Div(id="programs-graph")), dbc.Col(html.Div(id="cat-grievances-graph"))])])
-                ], className="my-4")
-    ],
-    fluid=True,
+            dbc.Row([dbc.Col(control_panel, md=3),
+                     dbc.Col([
+                         html.H2(id="title-2"),
+                         dbc.Row([dbc.Col(html.Div(id="enrollment-card")), dbc.Col(html.Div(id="grievances-card"))]),
+                         dbc.Row([dbc.Col(html.Div(id="evol-enrollment")), dbc.Col(html.Div(id="grievances-enrollment"))]),
+                         dbc.Row([dbc.Col(html.Div(id="programs-graph")), dbc.Col(html.Div(id="cat-grievances-graph"))])])
+                    ], className="my-4")
+        ],
+        fluid=True,
+    )
+
+app.layout = serve_layout
+
+@app.server.route("/health")
+def health():
+    return jsonify(dashboard_data.status())
+
+@app.server.route("/metrics")
+def metrics_endpoint():
+    return metrics.prometheus_text(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.server.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.server.before_request
+def start_data():
+    # Any request starts loading the data, so a server that never calls main()
+    # (e.g. gunicorn) gets ready on the first health check
+    dashboard_data.start_warm_up()
+
+@app.server.after_request
+def observe_callback(response):
+    # Every callback is served by the same route; its output names it
+    if request.path.endswith("/_dash-update-component") and "started" in g:
+        body = request.get_json(silent=True) or {}
+        metrics.observe(f"callback.{body.get('output', 'unknown')}", time.perf_counter() - g.started)
+    return response
+
+@app.server.route("/ready")
+def ready():
+    status = dashboard_data.status()
+    return jsonify(status), 200 if status["status"] == "ready" else 503
+
+def current_snapshot() -> dict:
+    '''
+    Helper function to get the data for a callback, skipping the update while
+    the data is still loading
+    '''
+    snapshot = dashboard_data.current()
+    if snapshot is None:
+        raise PreventUpdate
+    return snapshot
+
+@callback(
+    Output("data-version", "data"),
+    Output("data-poll", "interval"),
+    Output("data-status", "children"),
+    Output("district-dropdown", "options"),
+    Input("data-poll", "n_intervals"),
+    State("data-version", "data")
 )
+def poll_data(n_intervals, version):
+    status = dashboard_data.status()
+    if status["status"] == "error":
+        error = dbc.Alert(f"The data could not be loaded ({status['error']}).", color="danger")
+        return no_update, RELOAD_POLL_MS, error, no_update
+    snapshot = current_snapshot()
+    if snapshot["data_version"] == version:
+        raise PreventUpdate
+    return snapshot["data_version"], RELOAD_POLL_MS, None, snapshot["districts"]
 
 @callback(
     Output("enrollment-card", "children"),
     Input("year-dropdown", "value"),
-    Input("district-dropdown", "value")
+    Input("district-dropdown", "value"),
+    Input("data-version", "data")
 )
-def make_card_enrollment(selected_year, selected_district):
-    data = tables[-1]
-    data = data[(data["year"] == selected_year) & (data["district"] == selected_district)]
-    enrollment_data = data.groupby(["year", "district"])["enrollment"].sum().reset_index()
-    n_enrolled = enrollment_data.loc[0,"enrollment"]
-    n_programs = len(data["program"].unique())
+def make_card_enrollment(selected_year, selected_district, version = None):
+    cubes = current_snapshot()["cubes"]
+    data = lookup(cubes[5], "by_year_district", (selected_year, selected_district))
+    n_enrolled = data["enrollment"].sum()
+    n_programs = data["program"].nunique()
 
     enrollment = dbc.Alert(dcc.Markdown(
         f"""
@@ -155,14 +238,14 @@ def make_card_enrollment(selected_year, selected_district):
 @callback(
     Output("grievances-card", "children"),
     Input("year-dropdown", "value"),
-    Input("district-dropdown", "value")
+    Input("district-dropdown", "value"),
+    Input("data-version", "data")
 )
-def make_card_grievances(selected_year, selected_district):
-    data = tables[-2]
-    data = data[(data["year"] == selected_year) & (data["district_name"] == selected_district)]
-    grievances_data = data.groupby(["year", "district_name"])["num_grievances"].sum().reset_index()
-    n_grievances = grievances_data.loc[0,"num_grievances"]
-    n_types = len(data["cat_grivance"].unique())
+def make_card_grievances(selected_year, selected_district, version = None):
+    cubes = current_snapshot()["cubes"]
+    data = lookup(cubes[4], "by_year_district", (selected_year, selected_district))
+    n_grievances = data["num_grievances"].sum()
+    n_types = data["cat_grivance"].nunique()
 
     enrollment = dbc.Alert(dcc.Markdown(
         f"""
@@ -178,94 +261,165 @@ def make_card_grievances(selected_year, selected_district):
     return card
 
 
+LABELS = {'year' : 'Year',
+          'enrollment' : "Annual Enrollment",
+          'gender' : "Gender",
+          'num_grievances' : "Number of Grievances",
+          'cat_grivance' : "Type of Grievance",
+          'district' : "District Name",
+          'grievances_pc' : 'Grievances per 1,000 students',
+          'program' : "Program Name"}
+
+def render_chart(snapshot: dict, name: str, inputs: tuple, chart_fn: str, *args, **kwargs) -> dict:
+    '''
+    Helper function to get the Vega-Lite spec of a chart, with its data inlined.
+    It is only rendered again when the data version or the inputs it depends on
+    change. chart_fn is the name of the function in figures.py, which is only
+    imported (with altair) the first time a chart is rendered.
+    '''
+    def render():
+        from . import figures
+        return getattr(figures, chart_fn)(*args, **kwargs).to_dict()
+
+    return cached_figure((name, snapshot["data_version"], *inputs), render)
+
+def chart_frame(spec: dict, center: bool = False) -> dvc.Vega:
+    '''
+    Helper function to show a chart in the page. Only the spec is sent; every
+    chart is drawn by the same Vega runtime, loaded once with the page.
+    '''
+    style = {"width": "100%", "height": "300px"}
+    if center:
+        style["alignItems"] = "center"
+    return dvc.Vega(spec = spec, opt = {"actions": False}, style = style)
+
 @callback(
     Output("enrollment-gender", "children"),
+    Input("data-version", "data")
+)
+def enrollment_gender_chart(version = None) -> dvc.Vega:
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "enrollment_gender", (), "gen_bar_chart_by",
+                                    snapshot["tables"][0], x_var = "year", y_var ="enrollment",
+                                    by_var = "gender", title = "Evolution of Enrollment by Gender",
+                                    labels = LABELS))
+
+@callback(
     Output("grievances-cat", "children"),
-    Output("grievances-pc", "children"),
+    Input("data-version", "data")
+)
+def grievances_cat_chart(version = None) -> dvc.Vega:
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "grievances_cat", (), "gen_bar_chart_by",
+                                    snapshot["tables"][1], x_var = "year", y_var ="num_grievances",
+                                    by_var = "cat_grivance", title = "Evolution of Grievances by Type",
+                                    labels = LABELS))
+
+@callback(
     Output("scatter-graph", "children"),
+    Input("data-version", "data")
+)
+def scatter_chart(version = None) -> dvc.Vega:
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "scatter", (), "create_scatter",
+                                    snapshot["tables"][2], x_var = 'enrollment', y_var = 'grievances_pc', labels = LABELS,
+                                    title = "Relationship Between Enrollment and Grievances 2020 - 2024"),
+                       center = True)
+
+@callback(
+    Output("grievances-pc", "children"),
+    Input("year-dropdown", "value"),
+    Input("data-version", "data")
+)
+def update_grievances_pc(selected_year, version = None):
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "grievances_pc", (selected_year,), "create_interactive_bar",
+                                    lookup(snapshot["cubes"][2], "by_year", selected_year),
+                                    x_var = "grievances_pc", y_var = "district", labels = LABELS, 
+                                    title = "Number of Grievances per 1,000 students by Districts",
+                                    fmt = ".2f"),
+                       center = True)
+
+@callback(
     Output("programs-graph", "children"),
+    Input("year-dropdown", "value"),
+    Input("district-dropdown", "value"),
+    Input("data-version", "data")
+)
+def update_programs_graph(selected_year, selected_district, version = None):
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "programs_graph", (selected_year, selected_district), "create_interactive_bar",
+                                    lookup(snapshot["cubes"][5], "by_year_district", (selected_year, selected_district)),
+                                    x_var = "enrollment", y_var = "program", labels = LABELS, 
+                                    title = f"Enrollment by Program in {selected_district}, {selected_year}",
+                                    fmt = ","))
+
+@callback(
     Output("cat-grievances-graph", "children"),
+    Input("year-dropdown", "value"),
+    Input("district-dropdown", "value"),
+    Input("data-version", "data")
+)
+def update_cat_grievances_graph(selected_year, selected_district, version = None):
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "cat_grievances_graph", (selected_year, selected_district), "create_interactive_bar",
+                                    lookup(snapshot["cubes"][4], "by_year_district", (selected_year, selected_district)),
+                                    x_var = "num_grievances", y_var = "cat_grivance", labels = LABELS, 
+                                    title = f"Number of Grievances by Type in {selected_district}, {selected_year}",
+                                    fmt = ","))
+
+@callback(
     Output("evol-enrollment", "children"),
+    Input("district-dropdown", "value"),
+    Input("data-version", "data")
+)
+def update_evol_enrollment(selected_district, version = None):
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "enrollment_dist", (selected_district,), "gen_bar_chart",
+                                    lookup(snapshot["cubes"][5], "yearly_by_district", selected_district),
+                                    x_var = "year", y_var = "enrollment",
+                                    title = f"Evolution of Enrollment in {selected_district}", labels=LABELS))
+
+@callback(
     Output("grievances-enrollment", "children"),
+    Input("district-dropdown", "value"),
+    Input("data-version", "data")
+)
+def update_grievances_enrollment(selected_district, version = None):
+    snapshot = current_snapshot()
+    return chart_frame(render_chart(snapshot, "grievances_dist", (selected_district,), "gen_bar_chart",
+                                    lookup(snapshot["cubes"][4], "yearly_by_district", selected_district),
+                                    x_var = "year", y_var = "num_grievances",
+                                    title = f"Evolution of Grievances in {selected_district}", labels=LABELS))
+
+@callback(
     Output("title-2", "children"),
     Input("year-dropdown", "value"),
     Input("district-dropdown", "value")
 )
-def update_charts(selected_year, selected_district):
-    
-    labels_dict = {'year' : 'Year',
-                   'enrollment' : "Annual Enrollment",
-                   'gender' : "Gender",
-                   'num_grievances' : "Number of Grievances",
-                   'cat_grivance' : "Type of Grievance",
-                   'district' : "District Name",
-                   'grievances_pc' : 'Grievances per 1,000 students',
-                   'program' : "Program Name"}
-    enrollment_gender = gen_bar_chart_by(tables[0], x_var = "year", y_var ="enrollment",
-                                         by_var = "gender", title = "Evolution of Enrollment by Gender",
-                                         labels = labels_dict)
-    grievances_cat = gen_bar_chart_by(tables[1], x_var = "year", y_var ="num_grievances",
-                                      by_var = "cat_grivance", title = "Evolution of Grievances by Type",
-                                      labels = labels_dict)
-    grievances_pc = create_interactive_bar(tables[2], selected_year = selected_year, selected_district = None,
-                                           x_var = "grievances_pc", y_var = "district", labels = labels_dict, 
-                                           title = "Number of Grievances per 1,000 students by Districts",
-                                           fmt = ".2f")
-    scatter = create_scatter(tables[2], x_var = 'enrollment', y_var = 'grievances_pc', labels = labels_dict,
-                             title = "Relationship Between Enrollment and Grievances 2020 - 2024")
-    programs_graph = create_interactive_bar(tables[5], selected_year = selected_year, selected_district = selected_district,
-                                           x_var = "enrollment", y_var = "program", labels = labels_dict, 
-                                           title = f"Enrollment by Program in {selected_district}, {selected_year}",
-                                           fmt = ",")
-    cat_grievances_graph = create_interactive_bar(tables[4], selected_year = selected_year, selected_district = selected_district,
-                                           x_var = "num_grievances", y_var = "cat_grivance", labels = labels_dict, 
-                                           title = f"Number of Grievances by Type in {selected_district}, {selected_year}",
-                                           fmt = ",")
-    enrollment_dist = gen_bar_chart(tables[5], x_var = "year", y_var = "enrollment", selected_district = selected_district,
-                                    title = f"Evolution of Enrollment in {selected_district}", labels=labels_dict)
-    grievances_dist = gen_bar_chart(tables[4], x_var = "year", y_var = "num_grievances", selected_district = selected_district,
-                                    title = f"Evolution of Grievances in {selected_district}", labels=labels_dict)
-    title_2 = f"Summary of {selected_district} Enrollment and Grievances in {selected_year}"
+def update_title(selected_year, selected_district):
+    return f"Summary of {selected_district} Enrollment and Grievances in {selected_year}"
 
+def update_charts(selected_year, selected_district):
+    '''
+    Function to render every chart and the title for a selection at once, in
+    the order of the page. Each output is served by its own callback; this is
+    kept for scripts that need the whole page.
+    '''
     return (
-        html.Iframe(
-            srcDoc = enrollment_gender.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0"},
-        ),
-        html.Iframe(
-            srcDoc = grievances_cat.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0"},
-        ),
-        html.Iframe(
-            srcDoc = grievances_pc.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0",
-                   "alignItems": "center"},
-        ),
-        html.Iframe(
-            srcDoc = scatter.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0",
-                   "alignItems": "center"},
-        ),
-        html.Iframe(
-            srcDoc = programs_graph.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0"},
-        ),
-        html.Iframe(
-            srcDoc = cat_grievances_graph.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0"},
-        ),
-        html.Iframe(
-            srcDoc = enrollment_dist.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0"},
-        ),
-        html.Iframe(
-            srcDoc = grievances_dist.to_html(),
-            style={"width": "100%", "height": "300px", "border": "0"},
-        ),        
-        title_2
+        enrollment_gender_chart(),
+        grievances_cat_chart(),
+        update_grievances_pc(selected_year),
+        scatter_chart(),
+        update_programs_graph(selected_year, selected_district),
+        update_cat_grievances_graph(selected_year, selected_district),
+        update_evol_enrollment(selected_district),
+        update_grievances_enrollment(selected_district),
+        update_title(selected_year, selected_district),
     )
 
 def main():
+    dashboard_data.start_warm_up()
     app.run(debug=False)
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CATEGORICAL_COLUMNS = ["district", "district_name", "program", "gender", "cat_grivance"]
+
+
+def as_categoricals(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Helper function to store the low-cardinality text columns as categoricals
+    '''
+    columns = {col: "category" for col in CATEGORICAL_COLUMNS if col in df.columns}
+    return df.astype(columns)
+
+
+def build_cube(df: pd.DataFrame, district_col: str, measure: str) -> dict:
+    '''
+    Function to partition a query result once, so the dashboard callbacks
+    look up their slice instead of filtering the whole table
+
+    Args:
+        - df: dataframe with a year column and a district column
+        - district_col: name of the district column
+        - measure: column summed in the yearly totals of each district
+
+    Returns: dict with the slices by (year, district), by year and by district,
+    and the yearly totals of the measure by district
+    '''
+    df = as_categoricals(df)
+    yearly = df.groupby(["year", district_col], observed=True)[measure].sum().reset_index()
+    return {
+        "by_year_district": dict(list(df.groupby(["year", district_col], observed=True))),
+        "by_year": dict(list(df.groupby("year"))),
+        "by_district": dict(list(df.groupby(district_col, observed=True))),
+        "yearly_by_district": dict(list(yearly.groupby(district_col, observed=True))),
+        "empty": {"table": df.iloc[0:0], "yearly": yearly.iloc[0:0]},
+    }
+
+
+def lookup(cube: dict, part: str, key) -> pd.DataFrame:
+    '''
+    Function to get a slice of the cube, or an empty frame if there is no data
+
+    Args:
+        - cube: output of build_cube
+        - part: 'by_year_district', 'by_year', 'by_district' or 'yearly_by_district'
+        - key: (year, district), year or district
+
+    Returns: pd.DataFrame
+    '''
+    empty = cube["empty"]["yearly" if part == "yearly_by_district" else "table"]
+    return cube[part].get(key, empty)
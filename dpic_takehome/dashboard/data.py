@@ -0,0 +1,166 @@
+import time
+import threading
+from pathlib import Path
+from .cube import build_cube
+
+PATH_DB = Path("data/dpic.db")
+WATCH_INTERVAL = 30
+WARM_UP_RETRY = 5
+
+_snapshot = None
+_error = None
+_ready = threading.Event()
+_started = False
+_lock = threading.Lock()
+
+
+def load_snapshot(db_path: Path = PATH_DB) -> dict:
+    '''
+    Function to run the dashboard queries, concurrently over read-only
+    connections, and build everything derived from them. The snapshot is
+    never modified once built.
+
+    Returns: dict with the query results, their cubes, the data version, the
+    districts available and the database they come from
+    '''
+    from ..data_pipeline.run_queries import run_queries, db_version
+
+    version = db_version(db_path)
+    tables = list(run_queries(db_path, parallel=True, cache=True).values())
+    return {
+        "tables": tables,
+        "cubes": {2: build_cube(tables[2], "district", "num_grievances"),
+                  4: build_cube(tables[4], "district_name", "num_grievances"),
+                  5: build_cube(tables[5], "district", "enrollment")},
+        "data_version": version,
+        "districts": sorted(tables[-1]["district"].unique()),
+        "db_path": db_path,
+    }
+
+
+def warm_up(prepare=None, retry_interval: float = WARM_UP_RETRY):
+    '''
+    Function to load the first snapshot, optionally after running `prepare`
+    (e.g. the cleaning and loading pipeline), and then watch the database.
+    A failed attempt is reported by status() and retried every
+    `retry_interval` seconds until one succeeds.
+    '''
+    global _snapshot, _error
+    while _snapshot is None:
+        try:
+            if prepare is not None:
+                prepare()
+            _snapshot, _error = load_snapshot(), None
+        except Exception as e:
+            _error = f"{type(e).__name__}: {e}"
+        _ready.set()
+        if _snapshot is None:
+            time.sleep(retry_interval)
+    watch()
+
+
+def reload(db_path: Path = PATH_DB) -> dict:
+    '''
+    Function to replace the snapshot right away, without the background
+    thread (e.g. in scripts that load the database and then render charts).
+    The background thread is not started afterwards either, so nothing runs
+    alongside the caller.
+
+    Returns: the snapshot
+    '''
+    global _snapshot, _error, _started
+    with _lock:
+        _started = True
+    _snapshot, _error = load_snapshot(db_path), None
+    _ready.set()
+    return _snapshot
+
+
+def refresh() -> bool:
+    '''
+    Function to reload the snapshot if a load of the database it was built
+    from finished since then. The version only changes once a whole load is recorded as
+    complete (see data_to_db.record_load_complete), so a load in progress is
+    never picked up half way. The new snapshot replaces the old one in a
+    single assignment: requests that already hold the old snapshot finish
+    with it, new requests get the new one.
+
+    Returns: True if the snapshot was replaced
+    '''
+    global _snapshot
+    from ..data_pipeline.run_queries import db_version
+
+    db_path = _snapshot["db_path"]
+    if db_version(db_path) == _snapshot["data_version"]:
+        return False
+    _snapshot = load_snapshot(db_path)
+    return True
+
+
+def watch(interval: float = WATCH_INTERVAL):
+    '''
+    Function to check the database for changes every `interval` seconds and
+    swap in a new snapshot when it changed. Errors keep the current snapshot,
+    are reported by status() until a check succeeds and are retried.
+    '''
+    global _error
+    while True:
+        time.sleep(interval)
+        try:
+            refresh()
+            _error = None
+        except Exception as e:
+            _error = f"{type(e).__name__}: {e}"
+
+
+def start_warm_up(prepare=None):
+    '''
+    Function to load the data in a background thread, which then keeps
+    watching the database for changes. It only starts once per process, so it
+    is safe to call from every request.
+    '''
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=warm_up, args=(prepare,), name="dashboard-warm-up", daemon=True).start()
+
+
+def current() -> dict | None:
+    '''
+    Function to get the current snapshot without blocking
+
+    Returns: the snapshot, or None while the data is still loading
+    '''
+    start_warm_up()
+    return _snapshot
+
+
+def wait_ready(timeout: float | None = None) -> dict:
+    '''
+    Function to block until the data is loaded
+
+    Returns: the snapshot
+    '''
+    start_warm_up()
+    if not _ready.wait(timeout):
+        raise TimeoutError("Dashboard data is still loading")
+    if _snapshot is None:
+        raise RuntimeError(f"Dashboard data failed to load: {_error}")
+    return _snapshot
+
+
+def status() -> dict:
+    '''
+    Function to describe the state of the dashboard data for health checks
+    '''
+    snapshot, error = _snapshot, _error
+    if snapshot is not None:
+        # The data stays served while reloading it fails
+        if error is not None:
+            return {"status": "ready", "data_version": snapshot["data_version"], "refresh_error": error}
+        return {"status": "ready", "data_version": snapshot["data_version"]}
+    if error is not None:
+        return {"status": "error", "error": error}
+    return {"status": "loading"}
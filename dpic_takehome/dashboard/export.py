@@ -0,0 +1,81 @@
+import gzip
+import json
+import itertools
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from plotly.utils import PlotlyJSONEncoder
+from . import app, data
+
+PATH_EXPORT = Path("data/static")
+
+
+def write_json(path: Path, content: dict):
+    '''
+    Helper function to write a gzip-compressed JSON file, serializing Dash
+    components the same way Dash sends them to the browser
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "wt") as f:
+        json.dump(content, f, cls=PlotlyJSONEncoder, separators=(",", ":"))
+
+
+def export_selection(selection: tuple, out_dir: Path = PATH_EXPORT) -> str:
+    '''
+    Function to render every output that depends on the dropdowns for one
+    (year, district) selection. The data must already be loaded in this
+    process with data.reload (main does it in every worker).
+
+    Args:
+        - selection: tuple with the year and the district
+        - out_dir: Path object of the export directory
+
+    Returns: path of the file, relative to out_dir
+    '''
+    year, district = selection
+    outputs = {
+        "title-2": app.update_title(year, district),
+        "enrollment-card": app.make_card_enrollment(year, district),
+        "grievances-card": app.make_card_grievances(year, district),
+        "grievances-pc": app.update_grievances_pc(year),
+        "programs-graph": app.update_programs_graph(year, district),
+        "cat-grievances-graph": app.update_cat_grievances_graph(year, district),
+        "evol-enrollment": app.update_evol_enrollment(district),
+        "grievances-enrollment": app.update_grievances_enrollment(district),
+    }
+    file = f"{year}/{district}.json.gz"
+    write_json(out_dir / file, outputs)
+    return file
+
+
+def main(out_dir: Path = PATH_EXPORT, max_workers: int | None = None):
+    '''
+    Function to export the whole dashboard as static files: the global charts,
+    one file per (year, district) selection rendered in a process pool, and an
+    index mapping each selection to its file. The data is loaded with
+    data.reload, in this process and in each worker, so no background thread
+    is running when the pool forks.
+    '''
+    snapshot = data.reload()
+    write_json(out_dir / "global.json.gz", {
+        "enrollment-gender": app.enrollment_gender_chart(),
+        "grievances-cat": app.grievances_cat_chart(),
+        "scatter-graph": app.scatter_chart(),
+    })
+
+    selections = list(itertools.product(app.YEARS, snapshot["districts"]))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=data.reload) as executor:
+        files = list(executor.map(export_selection, selections, itertools.repeat(out_dir)))
+
+    index = {
+        "data_version": snapshot["data_version"],
+        "years": app.YEARS,
+        "districts": snapshot["districts"],
+        "global": "global.json.gz",
+        "selections": {f"{year}|{district}": file for (year, district), file in zip(selections, files)},
+    }
+    with open(out_dir / "index.json", "w") as f:
+        json.dump(index, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
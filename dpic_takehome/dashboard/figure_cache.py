@@ -0,0 +1,43 @@
+from collections import OrderedDict
+from threading import Lock
+
+MAX_FIGURES = 512
+
+_figures = OrderedDict()
+_lock = Lock()
+
+
+def cached_figure(key: tuple, render, max_figures: int = MAX_FIGURES):
+    '''
+    Function to memoize rendered figures. The key must include everything the
+    figure depends on (chart name, data version and the selected inputs), so a
+    figure that ignores an input is shared by every value of that input. The
+    least recently used figures are evicted beyond max_figures.
+
+    Args:
+        - key: tuple identifying the figure
+        - render: function without arguments that renders the figure
+        - max_figures: maximum number of figures kept in memory
+
+    Returns: the rendered figure
+    '''
+    with _lock:
+        if key in _figures:
+            _figures.move_to_end(key)
+            return _figures[key]
+
+    figure = render()
+    with _lock:
+        _figures[key] = figure
+        _figures.move_to_end(key)
+        while len(_figures) > max_figures:
+            _figures.popitem(last=False)
+    return figure
+
+
+def clear_figures():
+    '''
+    Function to drop every cached figure
+    '''
+    with _lock:
+        _figures.clear()
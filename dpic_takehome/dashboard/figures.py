@@ -30,8 +30,11 @@ def gen_bar_chart_by(df: pd.DataFrame, x_var: str, y_var: str, by_var: str,
 
     return bar
 
-def create_interactive_bar(df: pd.DataFrame, selected_year: int, selected_district: int | None,
-                           x_var: str, y_var: str, labels: dict, title: str, fmt: str):
+def create_interactive_bar(df: pd.DataFrame, x_var: str, y_var: str, labels: dict, title: str, fmt: str):
+    '''
+    Function to create an interactive bar chart with its average line. df must
+    already hold only the selected year (and district)
+    '''
 
     select = alt.selection_point(name="select", on="click")
     highlight = alt.selection_point(name="highlight", on="pointerover", empty=False)
@@ -43,13 +46,6 @@ def create_interactive_bar(df: pd.DataFrame, selected_year: int, selected_distri
         .otherwise(alt.value(0))
     )
 
-    df = df[df["year"] == selected_year]
-    if selected_district is not None:
-        if "district" in df.columns:
-            df = df[df["district"] == selected_district]
-        else:
-            df = df[df["district_name"] == selected_district]
-    
     bar = (
         alt.Chart(df)
         .mark_bar(stroke="black", cursor="pointer")
@@ -68,7 +64,7 @@ def create_interactive_bar(df: pd.DataFrame, selected_year: int, selected_distri
             opacity=alt.condition(select, alt.value(1), alt.value(0.3)),
             tooltip = [
                 alt.Tooltip(f"{x_var}:Q", title =labels[x_var]),
-                alt.Tooltip(f"{y_var}", title=labels[y_var]),
+                alt.Tooltip(f"{y_var}:N", title=labels[y_var]),
             ],
             strokeWidth=stroke_width,
         )
@@ -140,20 +136,14 @@ def create_scatter(df: pd.DataFrame, x_var: str, y_var: str, labels: dict,
     )
     return chart
 
-def gen_bar_chart(df: pd.DataFrame, x_var: str, y_var: str, selected_district: str,
+def gen_bar_chart(df: pd.DataFrame, x_var: str, y_var: str,
                   title: str, labels: dict) -> alt.Chart:
     '''
-    Function to create a bar chart 
+    Function to create a bar chart. df must already hold the yearly totals of
+    the selected district
     '''
     # color_scale = alt.Scale(domain=["Female", "Male", "Other"], range=["#005A9C", "#A8D0E6", "#A8F0F6"])
     
-    if "district" in df.columns:
-        df = df[df["district"] == selected_district]
-        df = df.groupby(['year', 'district'])[y_var].sum().reset_index()
-    else:
-        df = df[df["district_name"] == selected_district]
-        df = df.groupby(['year', 'district_name'])[y_var].sum().reset_index()
-
     bar = alt.Chart(df).mark_bar().encode(
         x = alt.X(
             f"{x_var}:N",
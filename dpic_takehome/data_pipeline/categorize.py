@@ -0,0 +1,231 @@
+import re
+import json
+import math
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from collections import Counter
+from pathlib import Path
+
+PATH_MODEL = Path("data/models/grievance_classifier.json")
+DEFAULT_CATEGORY = "Other"
+# Cosine similarity below which the classifier falls back to DEFAULT_CATEGORY
+MIN_SCORE = 0.2
+MAX_CACHE = 100_000
+
+# Rules are tried in order and the first one with a match in the text wins.
+# Keywords are RE2 regexes (no lookarounds or backreferences). Bump
+# cleaning.STAGE_VERSIONS["grievances"] when they change.
+RULES = [
+    ("No action, past month", [r"no action", r"no response", r"not (?:been )?(?:resolved|addressed)",
+                               r"(?:registered|filed|submitted)\b.*\b(?:last month|weeks? ago|months? ago)"]),
+    ("Instructor issues", [r"trainers?", r"instructors?", r"teachers?", r"faculty", r"tutors?"]),
+    ("Equipment and materials", [r"equipment", r"materials?", r"tools?", r"machines?", r"machinery",
+                                 r"raw material", r"consumables?"]),
+    ("Utilities", [r"water", r"electricity", r"power (?:cut|supply)", r"internet", r"wi-?fi", r"hostel",
+                   r"toilets?", r"sanitation", r"drinking"]),
+    ("Other", [r"stipends?", r"scholarships?", r"practical (?:classes|training)", r"certificates?"]),
+]
+
+# Categories of the texts seen so far, valid for the model they were made with
+_cache = {"model": None, "categories": {}}
+_model = {"path": None, "mtime": None, "model": None}
+
+
+def compile_rules(rules: list = RULES) -> str:
+    '''
+    Helper function to join the rules into a single RE2 pattern, run by
+    pyarrow over a whole column at once. Every alternative is anchored at the
+    start of the text and RE2 prefers the first alternative that matches, so
+    a single pass finds the first rule with a keyword anywhere in the text.
+
+    Returns: str with the pattern, with one named group per rule
+    '''
+    alternatives = [rf".*?\b(?P<r{ix}>{'|'.join(keywords)})\b" for ix, (_, keywords) in enumerate(rules)]
+    return rf"(?is)^(?:{'|'.join(alternatives)})"
+
+
+RULES_PATTERN = compile_rules()
+
+
+def apply_rules(texts: pd.Series, pattern: str = RULES_PATTERN, rules: list = RULES) -> pd.Series:
+    '''
+    Function to categorize texts with the rules, in one vectorized pass
+
+    Args:
+        - texts: pd.Series of texts
+        - pattern: rules compiled with compile_rules
+        - rules: list of (category, keywords) the pattern was compiled from
+
+    Returns: pd.Series with the category of each text, None if no rule matches
+    '''
+    groups = pc.extract_regex(pa.array(texts, type=pa.string()), pattern)
+    # Groups of the rules that did not match hold empty strings
+    is_match = np.column_stack([groups.field(ix).to_numpy(zero_copy_only=False) != "" for ix in range(len(rules))])
+    is_match &= groups.is_valid().to_numpy(zero_copy_only=False)[:, None]
+    names = np.array([category for category, _ in rules], dtype=object)
+    return pd.Series(np.where(is_match.any(axis=1), names[is_match.argmax(axis=1)], None), index=texts.index)
+
+
+def tokenize(text: str) -> list:
+    '''
+    Helper function to split a text into lowercase words and word pairs
+    '''
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def tf_idf(text: str, vocab: dict, idf: list) -> dict:
+    '''
+    Helper function to get the L2-normalized TF-IDF weights of the known terms
+    of a text
+
+    Returns: dict mapping the position of each term in the vocabulary to its weight
+    '''
+    counts = Counter(term for term in tokenize(text) if term in vocab)
+    weights = {vocab[term]: n * idf[vocab[term]] for term, n in counts.items()}
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return {ix: w / norm for ix, w in weights.items()}
+
+
+def train(texts: list, labels: list) -> dict:
+    '''
+    Function to train the fallback classifier: a TF-IDF representation and a
+    linear model with one weight vector per category (the normalized mean
+    of its texts, i.e. a nearest centroid classifier). It only needs numpy
+    and runs offline.
+
+    Args:
+        - texts: list of texts
+        - labels: list with the category of each text
+
+    Returns: dict with the model, ready to be saved as JSON
+    '''
+    documents = [set(tokenize(text)) for text in texts]
+    frequency = Counter(term for terms in documents for term in terms)
+    vocab = {term: ix for ix, term in enumerate(sorted(frequency))}
+    idf = [math.log((1 + len(texts)) / (1 + frequency[term])) + 1 for term in sorted(frequency)]
+
+    classes = sorted(set(labels))
+    weights = np.zeros((len(classes), len(vocab)))
+    for text, label in zip(texts, labels):
+        for ix, w in tf_idf(text, vocab, idf).items():
+            weights[classes.index(label), ix] += w
+    weights /= np.linalg.norm(weights, axis=1, keepdims=True).clip(min=1e-12)
+    return {"classes": classes, "vocab": vocab, "idf": idf, "weights": weights.round(6).tolist()}
+
+
+def predict(model: dict, texts: list, min_score: float = MIN_SCORE) -> list:
+    '''
+    Function to categorize texts with the fallback classifier
+
+    Args:
+        - model: dict returned by train or load_model
+        - texts: list of texts
+        - min_score: similarity below which DEFAULT_CATEGORY is returned
+
+    Returns: list with the category of each text
+    '''
+    weights = np.asarray(model["weights"])
+    categories = []
+    for text in texts:
+        terms = tf_idf(text, model["vocab"], model["idf"])
+        if not terms:
+            categories.append(DEFAULT_CATEGORY)
+            continue
+        scores = weights[:, list(terms)] @ np.fromiter(terms.values(), float)
+        best = scores.argmax()
+        categories.append(model["classes"][best] if scores[best] >= min_score else DEFAULT_CATEGORY)
+    return categories
+
+
+def save_model(model: dict, path: Path = PATH_MODEL):
+    '''
+    Helper function to save the classifier as JSON
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(model, f)
+
+
+def load_model(path: Path = PATH_MODEL) -> dict | None:
+    '''
+    Helper function to load the classifier, kept in memory until the file
+    changes
+
+    Returns: dict with the model, or None if there is no trained model
+    '''
+    if not path.exists():
+        return None
+    mtime = path.stat().st_mtime
+    if _model["path"] != path or _model["mtime"] != mtime:
+        with open(path, "r") as f:
+            _model.update(path=path, mtime=mtime, model=json.load(f))
+    return _model["model"]
+
+
+def categorize(texts: pd.Series, model: dict | None = None) -> pd.Series:
+    '''
+    Function to categorize grievance texts. Each distinct text is categorized
+    once: by the rules, or by the classifier (if any) when no rule matches,
+    or as DEFAULT_CATEGORY. Results are cached across calls, since the same
+    texts repeat heavily.
+
+    Args:
+        - texts: pd.Series of texts
+        - model: classifier used for the texts no rule matches
+
+    Returns: pd.Series with the category of each text (None for missing texts)
+    '''
+    if _cache["model"] is not model:
+        _cache.update(model=model, categories={})
+    cache = _cache["categories"]
+
+    codes, uniques = pd.factorize(texts)
+    # The categories of this call are kept apart, so evicting the cache below
+    # does not lose the ones it already had
+    found = {text: cache[text] for text in uniques if text in cache}
+    new = pd.Series([text for text in uniques if text not in found], dtype=object)
+    if len(new):
+        categories = apply_rules(new)
+        unmatched = categories.isna()
+        if model is not None and unmatched.any():
+            categories[unmatched] = predict(model, new[unmatched].tolist())
+        categories = dict(zip(new, categories.fillna(DEFAULT_CATEGORY)))
+        found.update(categories)
+        if len(cache) + len(new) > MAX_CACHE:
+            cache.clear()
+        cache.update(categories)
+
+    # Missing texts get the code -1, which points to the trailing None
+    lookup = np.array([found[text] for text in uniques] + [None], dtype=object)
+    return pd.Series(lookup[codes], index=texts.index)
+
+
+def training_set(raw_path: Path, labels_path: Path | None = None) -> tuple:
+    '''
+    Helper function to build the training texts: the distinct texts of a raw
+    grievances file labeled by the rules, plus hand-labeled texts from a CSV
+    with text and category columns, which take precedence
+
+    Returns: tuple with the list of texts and the list of labels
+    '''
+    texts = pd.Series(pd.read_json(raw_path)["grievance_text"].dropna().unique(), dtype=object)
+    labeled = pd.DataFrame({"text": texts, "category": apply_rules(texts)}).dropna()
+    if labels_path is not None:
+        labeled = pd.concat([pd.read_csv(labels_path), labeled]).drop_duplicates("text")
+    return labeled["text"].tolist(), labeled["category"].tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the fallback grievance classifier")
+    parser.add_argument("--raw", type=Path, default=Path("data/raw/grievances.json"))
+    parser.add_argument("--labels", type=Path, help="CSV with text and category columns")
+    parser.add_argument("--out", type=Path, default=PATH_MODEL)
+    args = parser.parse_args()
+
+    texts, labels = training_set(args.raw, args.labels)
+    save_model(train(texts, labels), args.out)
+    print(f"Trained on {len(texts)} texts: {dict(Counter(labels))}")
@@ -1,11 +1,49 @@
 import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from collections import Counter
+from functools import partial
 from pathlib import Path
-import httpx
-from lxml.html import fromstring
-from jellyfish import jaro_winkler_similarity as jw
+from .. import metrics
+from ..data_pipeline import categorize
 
 URL_DISTRICTS = "https://web.archive.org/web/20120116131947/http://dolr.nic.in/Hyperlink/distlistnew.htm"
+PATH_NAMES_CACHE = Path("data/cache/official_names.json")
+PATH_CLEAN = Path("data/clean")
+PATH_CLEAN_DISTRICTS = Path("data/clean/districts.parquet")
+PARTITION_COLS = {"grievances": ["year"], "iti_enrollments": ["year"]}
+PATH_MANIFEST = Path("data/cache/build_manifest.json")
+# Bump the version of a stage whenever its cleaning logic changes
+STAGE_VERSIONS = {"grievances": 2, "iti_enrollments": 1, "districts": 1, "itis": 1}
+STAGE_RAW = {
+    "grievances": Path("data/raw/grievances.json"),
+    "iti_enrollments": Path("data/raw/iti_enrollments.csv"),
+    "districts": None,
+    "itis": None,
+}
+STAGE_UPSTREAM = {"itis": "iti_enrollments"}
+GRIEVANCES_KEYS = ["district_name", "submission_date", "grievance_text", "submitted_by", "year"]
+ITI_ENROLLMENTS_KEYS = ["year", "district", "institute_name", "program", "gender"]
+# Text columns stored as categoricals and fixed dtypes of the compact schema
+COMPACT_CATEGORIES = ["district", "district_name", "institute_name", "program", "gender",
+                      "grievance_text", "submitted_by", "cat_grievance_text"]
+COMPACT_DTYPES = {"year": "Int16", "did": "Int16", "iid": "Int16"}
+COMPACT_MEASURES = {"resolved": "float32", "enrolled": "float32"}
+PATH_ALIASES = Path("data/cache/district_aliases.json")
+# Official names sharing fewer character bigrams with a raw name are not scored
+MIN_SHARED_GRAMS = 2
+NAMES_CACHE_VERSION = 1
+NAMES_CACHE_TTL = 30 * 24 * 60 * 60
+
+_official_names = None
 
 
 def date_format(df: pd.DataFrame, column: str) -> pd.DataFrame:
@@ -28,17 +66,152 @@ def clean_text(text: str):
     return new_text
 
 
-def get_official_names(url=URL_DISTRICTS) -> list:
+def fetch_official_names(url=URL_DISTRICTS) -> list:
     """
-    Helper function to fetch official district names
+    Helper function to scrape official district names from the web
+
+    Args:
+        - url: page with the official list of districts
+
+    Returns: list with the official district names
     """
-    parser = fromstring(httpx.get(URL_DISTRICTS).text)
+    import httpx
+    from lxml.html import fromstring
+
+    parser = fromstring(httpx.get(url).text)
     xpath = parser.xpath('//a[@name="orissa"]/following-sibling::ul[1]')[0]
     official_names = [clean_text(child.text) for child in xpath.getchildren()]
     official_names.extend(["Bhubaneswar", "Rourkela"])
     return official_names
 
 
+def write_json(obj, path: Path):
+    """
+    Helper function to save a JSON file under a temporary name and swap it in,
+    so processes reading it at the same time never see it half written
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, suffix=".tmp", delete=False) as f:
+        json.dump(obj, f, indent=2)
+    os.replace(f.name, path)
+
+
+def read_names_snapshot(path=PATH_NAMES_CACHE) -> dict | None:
+    """
+    Helper function to read the on-disk snapshot of official district names
+
+    Args:
+        - path: Path object where the snapshot is located
+
+    Returns: dict with the snapshot, or None if it is missing, unreadable or
+    outdated
+    """
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except json.JSONDecodeError:
+        return None
+    if snapshot.get("version") != NAMES_CACHE_VERSION:
+        return None
+    return snapshot
+
+
+def write_names_snapshot(names: list, url=URL_DISTRICTS, path=PATH_NAMES_CACHE):
+    """
+    Helper function to save the official district names on disk with a
+    version stamp and the time they were fetched
+    """
+    snapshot = {
+        "version": NAMES_CACHE_VERSION,
+        "source": url,
+        "fetched_at": time.time(),
+        "names": names,
+    }
+    write_json(snapshot, path)
+
+
+def get_official_names(url=URL_DISTRICTS, ttl=NAMES_CACHE_TTL, refresh=False) -> list:
+    """
+    Helper function to get official district names. The list is loaded once
+    per process and shared by every caller. It comes from the on-disk snapshot
+    while it is fresher than `ttl` seconds, otherwise it is scraped again. If
+    the page cannot be reached, the last snapshot (even if stale) or the clean
+    districts table are used instead, so the pipeline also runs offline.
+
+    Args:
+        - url: page with the official list of districts
+        - ttl: maximum age in seconds of the snapshot
+        - refresh: if True, ignores the in-memory copy and the TTL
+
+    Returns: list with the official district names
+    """
+    global _official_names
+    if _official_names is not None and not refresh:
+        return list(_official_names)
+
+    snapshot = read_names_snapshot()
+    if snapshot and not refresh and time.time() - snapshot["fetched_at"] < ttl:
+        _official_names = snapshot["names"]
+        return list(_official_names)
+
+    import httpx
+
+    try:
+        names = fetch_official_names(url)
+        write_names_snapshot(names, url)
+    except (httpx.HTTPError, IndexError):
+        if snapshot:
+            names = snapshot["names"]
+        elif PATH_CLEAN_DISTRICTS.exists():
+            names = pd.read_parquet(PATH_CLEAN_DISTRICTS)["name"].tolist()
+        else:
+            raise
+
+    _official_names = names
+    return list(_official_names)
+
+
+def name_ngrams(name: str, n: int = 2) -> set:
+    """
+    Helper function to split a name into its lowercase character n-grams
+    """
+    text = f" {name.lower().strip()} "
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def build_name_index(lst_compare: list) -> dict:
+    """
+    Helper function to index the official names by their character bigrams, so
+    only names sharing enough bigrams with a raw name are scored
+
+    Args:
+        - lst_compare: list with all possible district names
+
+    Returns: dict from bigram to the positions in lst_compare of the names
+    that contain it
+    """
+    index = {}
+    for ix, name in enumerate(lst_compare):
+        for gram in name_ngrams(name):
+            index.setdefault(gram, []).append(ix)
+    return index
+
+
+def candidate_names(raw_name: str, index: dict, lst_compare: list) -> tuple:
+    """
+    Helper function to block the official names that are worth scoring against
+    a raw name: the ones sharing at least MIN_SHARED_GRAMS bigrams with it.
+    Only the index entries of the raw name are visited, and the blocked names
+    keep the order of `lst_compare` so ties resolve as before.
+
+    Returns: tuple with the blocked names (empty if none is close enough)
+    """
+    shared = Counter(ix for gram in name_ngrams(raw_name) for ix in index.get(gram, []))
+    return tuple(lst_compare[ix] for ix in sorted(ix for ix, n in shared.items() if n >= MIN_SHARED_GRAMS))
+
+
 def match_names(raw_name: str, lst_compare: list, threshold: float) -> str:
     """
     Helper function to match a raw name of a district with the most closest name
@@ -51,12 +224,88 @@ def match_names(raw_name: str, lst_compare: list, threshold: float) -> str:
 
     Returns: the closest name of the district
     """
-    best_match = max(lst_compare, key=lambda x: jw(raw_name, x))
-    similarity = jw(raw_name, best_match)
-    if similarity > threshold:
-        return best_match
-    else:
-        return raw_name
+    return match_block([raw_name], lst_compare, threshold)[raw_name]
+
+
+def match_block(raw_names: list, lst_compare: list, threshold: float) -> dict:
+    """
+    Helper function to match a batch of raw names against the same block of
+    official names, scoring the whole block in one pass
+
+    Args:
+        - raw_names: list with raw names of districts
+        - lst_compare: list with the official names of the block
+        - threshold: minimum score allowed to consider a match
+
+    Returns: dict from raw name to the closest name of the district, or to
+    itself when no name scores above the threshold
+    """
+    from jellyfish import jaro_winkler_similarity as jw
+
+    if not lst_compare:
+        return {name: name for name in raw_names}
+    scores = np.array([[jw(raw_name, x) for x in lst_compare] for raw_name in raw_names])
+    # argmax keeps the first of tied names, as max did
+    best = scores.argmax(axis=1)
+    return {name: lst_compare[ix] if scores[row, ix] > threshold else name
+            for row, (name, ix) in enumerate(zip(raw_names, best))}
+
+
+def read_aliases(official_names: list, path=PATH_ALIASES) -> dict:
+    """
+    Helper function to read the persistent table of resolved district spellings.
+    The table is discarded when the official names it was built with change.
+
+    Args:
+        - official_names: list with the current official district names
+        - path: Path object where the alias table is located
+
+    Returns: dict from raw spelling to matched name
+    """
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        table = json.load(f)
+    if table.get("official_names") != official_names:
+        return {}
+    return table["aliases"]
+
+
+def write_aliases(aliases: dict, official_names: list, path=PATH_ALIASES):
+    """
+    Helper function to save the table of resolved district spellings on disk,
+    merged with the table currently stored
+    """
+    # Spellings resolved by another process since this one read the table are kept
+    aliases = {**read_aliases(official_names, path), **aliases}
+    write_json({"official_names": official_names, "aliases": aliases}, path)
+
+
+def match_many(raw_names, official_names: list, threshold: float) -> dict:
+    """
+    Helper function to match a batch of raw district names. Spellings already
+    resolved in previous runs are looked up in the alias table; the rest are
+    grouped by their block of official names (see candidate_names), each block
+    is scored as a batch, and the results are added to the table.
+
+    Args:
+        - raw_names: iterable with the unique raw names of the districts
+        - official_names: list with all possible district names
+        - threshold: minimum score allowed to consider a match
+
+    Returns: dict from raw name to the closest name of the district
+    """
+    aliases = read_aliases(official_names)
+    unknown = [name for name in raw_names if name not in aliases]
+    if unknown:
+        index = build_name_index(official_names)
+        blocks = {}
+        for name in unknown:
+            blocks.setdefault(candidate_names(name, index, official_names), []).append(name)
+        for candidates, names in blocks.items():
+            aliases.update(match_block(names, list(candidates), threshold))
+        write_aliases(aliases, official_names)
+    return {name: aliases[name] for name in raw_names}
 
 
 def clean_district_names(df: pd.DataFrame, column: str) -> pd.DataFrame:
@@ -71,35 +320,21 @@ def clean_district_names(df: pd.DataFrame, column: str) -> pd.DataFrame:
     """
     official_names = get_official_names()
     unique_values = df.loc[:, column].unique()
-    matched_names = {
-        name: match_names(name, official_names, 0.8) for name in unique_values
-    }
-    df.loc[:, column] = df.loc[:, column].replace(matched_names)
+    matched_names = match_many(unique_values, official_names, 0.8)
+    df.loc[:, column] = df.loc[:, column].map(matched_names)
     return df
 
 def categorize_grievances(df: pd.DataFrame, column: str) -> pd.DataFrame:
     '''
-    Helper function to categorize grievances text
+    Helper function to categorize grievances text with the rules of
+    categorize.py, falling back to its classifier if one was trained
         Args:
         - df: dataframe
         - column: name of the column
 
     Returns: dataframe with the new categorization column
     '''
-    dict_categorize = {
-        'Hostel conditions are very poor, water supply is irregular.' : 'Utilities',
-        'Stipend not credited for the last three months.' : 'Other',
-        'Students are asked to arrange their own materials for practice.' : 'Equipment and materials',
-        'Trainer has not come to the institute for the past two weeks.' : 'Instructor issues',
-        'Internet not working in the computer lab for over a month.' : 'Utilities',
-        'Electricity is not available during class hours.' : 'Utilities',
-        'No practical classes being conducted for welding program.' : 'Other',
-        'Grievance was registered last month, no action yet.' : 'No action, past month',
-        'Lab equipment is broken and no replacement has been provided.' : 'Equipment and materials',
-        'Only one instructor for three different trades.' : 'Instructor issues'
-    }
-
-    df.loc[:, f'cat_{column}'] = df.loc[:,column].replace(dict_categorize)
+    df.loc[:, f'cat_{column}'] = categorize.categorize(df.loc[:, column], categorize.load_model())
     return df
 
 def handle_duplicates(
@@ -120,77 +355,484 @@ def handle_duplicates(
     Return: pd.DataFrame
     """
     df[agg_var] = pd.to_numeric(df[agg_var], errors="coerce").fillna(0)
-    return df.groupby(by=cols_id)[agg_var].aggregate(how).reset_index()
+    return df.groupby(by=cols_id, observed=True)[agg_var].aggregate(how).reset_index()
 
-def gen_ids(lst_uniques: list, id_name: str) -> pd.DataFrame:
+def gen_ids(lst_uniques: list, id_name: str, start: int = 0, compact: bool = False) -> pd.DataFrame:
     '''
-    Function to create a pd.DataFrame with official districts names
+    Function to create a pd.DataFrame with official districts names. Ids are
+    numbered from start + 1, so new names can be added after existing ids.
+    With compact=True, ids are small integers instead of zero-padded text.
     '''
-    tuple_list = [(str(ix+1).zfill(4), name) for ix, name in enumerate(lst_uniques)]
+    if compact:
+        ids = pd.array(range(start + 1, start + len(lst_uniques) + 1), dtype=COMPACT_DTYPES[id_name])
+        return pd.DataFrame({id_name: ids, 'name': list(lst_uniques)})
+    tuple_list = [(str(start+ix+1).zfill(4), name) for ix, name in enumerate(lst_uniques)]
     df = pd.DataFrame(tuple_list)
     df.columns = [id_name, 'name']
     return pd.DataFrame(df)
 
-def clean_grievances(path: Path) -> pd.DataFrame:
+def assign_ids(values: pd.Series, ids: pd.DataFrame, id_name: str) -> pd.Series:
+    '''
+    Helper function to get the id of each name from the categorical codes of
+    the names, so each distinct name is looked up once instead of merging
+    every row against the ids
+
+    Args:
+        - values: names to identify
+        - ids: dataframe returned by gen_ids
+        - id_name: name of the id column
+
+    Returns: pd.Series with the ids, missing for unknown names
+    '''
+    codes = pd.Categorical(values, categories=ids['name']).codes
+    return pd.Series(ids[id_name].array.take(codes, allow_fill=True), index=values.index)
+
+def compact_frame(df: pd.DataFrame, measures: bool = True) -> pd.DataFrame:
+    '''
+    Helper function to convert a frame to the compact schema: low-cardinality
+    text as categoricals, ids as small integers and narrow numeric measures
+
+    Args:
+        - df: dataframe
+        - measures: False for raw rows, whose measures are not numeric yet
+
+    Returns: pd.DataFrame with the compact dtypes
+    '''
+    dtypes = {col: "category" for col in COMPACT_CATEGORIES if col in df.columns}
+    dtypes.update(COMPACT_DTYPES | (COMPACT_MEASURES if measures else {}))
+    return df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns})
+
+def iter_json_records(path: Path, chunksize: int, buffer_size: int = 1 << 16):
     """
-    Function to load and clean data from citizens complaints
+    Helper function to read a JSON file with a top-level array incrementally,
+    without loading the whole file in memory
 
     Args:
         - path: Path object where the file is located
+        - chunksize: number of records per chunk
+        - buffer_size: number of characters read from the file at a time
+
+    Yields: lists with at most `chunksize` records
+    """
+    decoder = json.JSONDecoder()
+    records = []
+    with open(path, "r") as f:
+        buffer = f.read(buffer_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} does not contain a JSON array")
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                break
+            try:
+                record, end = decoder.raw_decode(buffer)
+                # A number at the end of the buffer may be cut in two (e.g. 12|345
+                # or 1.|5): it is only complete once the next delimiter is read
+                is_complete = eof or buffer[end:].lstrip()[:1] in (",", "]")
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                is_complete = False
+            if not is_complete:
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            records.append(record)
+            buffer = buffer[end:]
+            if len(records) == chunksize:
+                yield records
+                records = []
+    if records:
+        yield records
+
+
+def read_chunks(path: Path, chunksize: int | None = None):
+    """
+    Helper function to read a raw file either at once or in bounded chunks
+
+    Args:
+        - path: Path object where the file is located (.csv or .json)
+        - chunksize: number of rows per chunk, None to read the whole file
+
+    Yields: pd.DataFrame
+    """
+    if path.suffix == ".json":
+        if chunksize is None:
+            yield pd.read_json(path)
+        else:
+            for records in iter_json_records(path, chunksize):
+                yield pd.DataFrame.from_records(records)
+    elif chunksize is None:
+        yield pd.read_csv(path)
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def combine_duplicates(
+    partials: list, cols_id: list, how: str, agg_var: str
+) -> pd.DataFrame:
+    """
+    Helper function to merge the outputs of handle_duplicates over several
+    chunks into a single running aggregate
+
+    Args:
+        - partials : list of dataframes already deduplicated on cols_id
+        - cols_id : columns that uniquely identifies the data
+        - how : 'sum' or 'max', the same used in handle_duplicates
+        - agg_var : aggregate variable
+
+    Return: pd.DataFrame
+    """
+    if how not in ("sum", "max"):
+        raise ValueError(f"Cannot combine chunks aggregated with '{how}'")
+    if len(partials) == 1:
+        return partials[0]
+    df = pd.concat(partials, ignore_index=True)
+    return df.groupby(by=cols_id, observed=True)[agg_var].aggregate(how).reset_index()
+
+
+def dedup_chunks(chunks, clean_chunk, cols_id: list, how: str, agg_var: str,
+                 max_partials: int = 8) -> pd.DataFrame:
+    """
+    Helper function to clean and deduplicate a sequence of chunks. Only the
+    running aggregate is kept in memory, never the raw rows of past chunks.
+
+    Args:
+        - chunks: iterable of raw dataframes
+        - clean_chunk: function applied to each chunk before deduplication
+        - cols_id : columns that uniquely identifies the data
+        - how : 'sum' or 'max'
+        - agg_var : aggregate variable
+        - max_partials: number of partial aggregates kept before compacting
+
+    Return: pd.DataFrame
+    """
+    partials = []
+    for chunk in chunks:
+        metrics.add("rows_in", len(chunk))
+        chunk = clean_chunk(chunk)
+        partials.append(handle_duplicates(chunk, cols_id, how, agg_var))
+        if len(partials) >= max_partials:
+            partials = [combine_duplicates(partials, cols_id, how, agg_var)]
+    return combine_duplicates(partials, cols_id, how, agg_var)
+
+
+def clean_grievances_chunk(df: pd.DataFrame, compact: bool = False) -> pd.DataFrame:
+    """
+    Function to clean the row-level fields of citizens complaints
+
+    Args:
+        - df: raw dataframe
+        - compact: convert the rows to the compact schema
 
     Returns: pd.Dataframe
     """
-    df = pd.read_json(path)
     df = date_format(df, "submission_date")
     df['year'] = pd.to_datetime(df['submission_date']).dt.year
     df = clean_district_names(df, "district_name")
+    if compact:
+        df = compact_frame(df, measures=False)
+    return df
+
 
-    cols_id = ["district_name", "submission_date", "grievance_text", "submitted_by", "year"]
-    df = handle_duplicates(df, cols_id, how="max", agg_var="resolved")
-    districts = gen_ids(get_official_names(), 'did')
-    df = pd.merge(df, districts, how='left', left_on= 'district_name', right_on='name').drop(columns = ['name'])
+def finish_grievances(df: pd.DataFrame, compact: bool = False) -> pd.DataFrame:
+    """
+    Function to add the district ids and categories to deduplicated complaints
+
+    Args:
+        - df: dataframe returned by handle_duplicates
+        - compact: convert the rows to the compact schema
+
+    Returns: pd.Dataframe
+    """
+    districts = gen_ids(get_official_names(), 'did', compact=compact)
+    df['did'] = assign_ids(df['district_name'], districts, 'did')
     df = categorize_grievances(df , 'grievance_text')
+    if compact:
+        df = compact_frame(df)
     return df
 
 
-def clean_iti_enrollments(path: Path) -> pd.DataFrame:
+def clean_grievances(path: Path, chunksize: int | None = None, compact: bool = False) -> pd.DataFrame:
     """
-    Function to load and clean data from Industrial Training Institutes (ITIs)
+    Function to load and clean data from citizens complaints
 
     Args:
         - path: Path object where the file is located
+        - chunksize: number of records read at a time, None to read the whole file
+        - compact: build the table in the compact schema
+
+    Returns: pd.Dataframe
+    """
+    df = dedup_chunks(read_chunks(path, chunksize), partial(clean_grievances_chunk, compact=compact),
+                      GRIEVANCES_KEYS, how="max", agg_var="resolved")
+    return finish_grievances(df, compact)
+
+
+def clean_iti_enrollments_chunk(df: pd.DataFrame, compact: bool = False) -> pd.DataFrame:
+    """
+    Function to clean the row-level fields of ITIs enrollment
+
+    Args:
+        - df: raw dataframe
+        - compact: convert the rows to the compact schema
 
     Returns: pd.Dataframe
     """
-    df = pd.read_csv(path)
     df = clean_district_names(df, "district")
-    cols_id = ["year", "district", "institute_name", "program", "gender"]
-    df = handle_duplicates(df, cols_id, how="sum", agg_var="enrolled")
-    
-    # Generating districts id
-    districts = gen_ids(get_official_names(), 'did')
-    df = pd.merge(df, districts, how='left', left_on= 'district', right_on='name').drop(columns = ['name'])
-    
-    # Generating iti id
-    itis = gen_ids(df['institute_name'].unique(), 'iid')
-    df = pd.merge(df, itis, how='left', left_on= 'institute_name', right_on='name').drop(columns = ['name'])
+    if compact:
+        df = compact_frame(df, measures=False)
+    return df
+
+
+def finish_iti_enrollments(df: pd.DataFrame, itis: pd.DataFrame, compact: bool = False) -> pd.DataFrame:
+    """
+    Function to add the district and ITI ids to deduplicated enrollments
+
+    Args:
+        - df: dataframe returned by handle_duplicates
+        - itis: dataframe with the iid and name of each ITI
+        - compact: convert the rows to the compact schema
+
+    Returns: pd.Dataframe
+    """
+    districts = gen_ids(get_official_names(), 'did', compact=compact)
+    df['did'] = assign_ids(df['district'], districts, 'did')
+    df['iid'] = assign_ids(df['institute_name'], itis, 'iid')
+    if compact:
+        df = compact_frame(df)
     return df
 
-def main():
-    path_g = Path('data/raw/grievances.json')
-    path_i = Path('data/raw/iti_enrollments.csv')
-
-    df_g ,df_i = clean_grievances(path_g), clean_iti_enrollments(path_i)
-    districts = gen_ids(get_official_names(), 'did')
-    itis = gen_ids(df_i['institute_name'].unique(), 'iid')
-
-    path_clean = Path('data/clean')
-    if not path_clean.exists():
-        os.mkdir(path_clean)
-        df_g.to_csv(Path('data/clean/grievances.csv'), index = False)
-        df_i.to_csv(Path('data/clean/iti_enrollments.csv'), index = False)
-        districts.to_csv(Path('data/clean/districts.csv'), index = False)
-        itis.to_csv(Path('data/clean/itis.csv'), index = False)
+
+def clean_iti_enrollments(path: Path, chunksize: int | None = None, compact: bool = False) -> pd.DataFrame:
+    """
+    Function to load and clean data from Industrial Training Institutes (ITIs)
+
+    Args:
+        - path: Path object where the file is located
+        - chunksize: number of rows read at a time, None to read the whole file
+        - compact: build the table in the compact schema
+
+    Returns: pd.Dataframe
+    """
+    df = dedup_chunks(read_chunks(path, chunksize), partial(clean_iti_enrollments_chunk, compact=compact),
+                      ITI_ENROLLMENTS_KEYS, how="sum", agg_var="enrolled")
+    itis = gen_ids(df['institute_name'].unique(), 'iid', compact=compact)
+    return finish_iti_enrollments(df, itis, compact)
+
+def clean_path(name: str, clean_dir: Path = PATH_CLEAN) -> Path:
+    """
+    Helper function to get where a clean table is stored: a directory for
+    partitioned tables and a single file for the rest
+    """
+    if name in PARTITION_COLS:
+        return clean_dir / name
+    return clean_dir / f"{name}.parquet"
+
+
+def write_clean(df: pd.DataFrame, name: str, clean_dir: Path = PATH_CLEAN, replace: bool = True,
+                compact: bool = False):
+    """
+    Helper function to store a clean table as Parquet, keeping its dtypes.
+    Tables in PARTITION_COLS are written as a dataset partitioned by year
+    (e.g. grievances/year=2020/part-0.parquet); the rest are written as a
+    single file. With compact=True the table is stored in the compact
+    schema, so all partitions share the same dtypes.
+
+    Args:
+        - df: clean dataframe
+        - name: name of the table
+        - clean_dir: Path object of the clean layer
+        - replace: if False, only the partitions present in df are replaced
+        - compact: store the table in the compact schema
+    """
+    if compact:
+        df = compact_frame(df)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    path = clean_path(name, clean_dir)
+    if name in PARTITION_COLS:
+        if replace and path.exists():
+            shutil.rmtree(path)
+        ds.write_dataset(table, path, format="parquet",
+                         partitioning=PARTITION_COLS[name], partitioning_flavor="hive",
+                         existing_data_behavior="delete_matching",
+                         basename_template="part-{i}.parquet")
+    else:
+        os.makedirs(clean_dir, exist_ok=True)
+        pq.write_table(table, path)
+
+
+def clean_dataset(name: str, clean_dir: Path = PATH_CLEAN) -> ds.Dataset:
+    """
+    Helper function to open a clean table as a pyarrow dataset, so readers can
+    select columns and filter partitions without reading the whole table
+    """
+    if name in PARTITION_COLS:
+        return ds.dataset(clean_path(name, clean_dir), format="parquet", partitioning="hive")
+    return ds.dataset(clean_path(name, clean_dir), format="parquet")
+
+
+def clean_columns(dataset: ds.Dataset) -> list:
+    """
+    Helper function to get the columns of a clean table in their original
+    order (partition columns are otherwise moved to the end)
+    """
+    return [col["name"] for col in dataset.schema.pandas_metadata["columns"]]
+
+
+def read_clean(name: str, columns: list | None = None, years: list | None = None,
+               clean_dir: Path = PATH_CLEAN) -> pd.DataFrame:
+    """
+    Function to read a clean table. Only the requested columns and, for
+    partitioned tables, the requested years are read from disk.
+
+    Args:
+        - name: name of the table
+        - columns: columns to read (all of them by default)
+        - years: years to read (all of them by default)
+        - clean_dir: Path object of the clean layer
+
+    Returns: pd.DataFrame with the clean table
+    """
+    dataset = clean_dataset(name, clean_dir)
+    where = ds.field("year").isin(years) if years is not None else None
+    return dataset.to_table(columns=columns or clean_columns(dataset), filter=where).to_pandas()
+
+
+def iter_clean(name: str, batch_size: int, columns: list | None = None,
+               clean_dir: Path = PATH_CLEAN):
+    """
+    Function to read a clean table in batches of at most batch_size rows
+
+    Yields: pd.DataFrame with each batch
+    """
+    dataset = clean_dataset(name, clean_dir)
+    for batch in dataset.to_batches(columns=columns or clean_columns(dataset), batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def file_hash(path: Path, block_size: int = 1 << 20) -> str:
+    """
+    Helper function to get the sha256 of a file, reading it in blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(path=PATH_MANIFEST) -> dict:
+    """
+    Helper function to read the build manifest: for each stage, the inputs it
+    was last built from
+
+    Returns: dict with one entry per stage, empty if there is no manifest or
+    it cannot be read (so every stage is rebuilt)
+    """
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return {}
+
+
+def write_manifest(manifest: dict, path=PATH_MANIFEST):
+    """
+    Helper function to save the build manifest on disk
+    """
+    write_json(manifest, path)
+
+
+def stage_inputs(stage: str, names: list, compact: bool = False) -> dict:
+    """
+    Helper function to describe everything a stage depends on: the version of
+    its cleaning logic, the official names, the schema mode, the content hash
+    of its raw file and, for grievances, of the trained classifier
+
+    Args:
+        - stage: name of the clean table built by the stage
+        - names: official district names
+        - compact: whether the stage is built in the compact schema
+
+    Returns: dict that changes whenever the output of the stage may change
+    """
+    inputs = {
+        "version": STAGE_VERSIONS[stage],
+        "names": hashlib.sha256(json.dumps(names).encode()).hexdigest(),
+        "compact": compact,
+    }
+    if STAGE_RAW[stage] is not None:
+        inputs["raw"] = file_hash(STAGE_RAW[stage])
+    if stage == "grievances" and categorize.PATH_MODEL.exists():
+        inputs["model"] = file_hash(categorize.PATH_MODEL)
+    return inputs
+
+
+def build_stage(stage: str, chunksize: int | None = None, compact: bool = False) -> pd.DataFrame:
+    """
+    Function to build one clean table
+
+    Args:
+        - stage: name of the clean table
+        - chunksize: number of records read at a time, None to read the whole file
+        - compact: build the table in the compact schema
+
+    Returns: pd.DataFrame with the clean table
+    """
+    if stage == "grievances":
+        return clean_grievances(STAGE_RAW[stage], chunksize, compact)
+    if stage == "iti_enrollments":
+        return clean_iti_enrollments(STAGE_RAW[stage], chunksize, compact)
+    if stage == "districts":
+        return gen_ids(get_official_names(), 'did', compact=compact)
+    # ITIs keep the ids assigned while cleaning the enrollments
+    itis = read_clean("iti_enrollments", columns=["iid", "institute_name"])
+    itis = itis.drop_duplicates().sort_values("iid", ignore_index=True)
+    return itis.rename(columns={"institute_name": "name"})
+
+
+def main(chunksize: int | None = None, force: bool = False, compact: bool = False) -> list:
+    """
+    Function to build the clean layer. A stage is rebuilt only if its inputs
+    (see stage_inputs) changed since the build recorded in the manifest, its
+    output is missing or the stage it is derived from was rebuilt.
+
+    Args:
+        - chunksize: number of records read at a time, None to read the whole file
+        - force: rebuild every stage regardless of the manifest
+        - compact: build the clean layer in the compact schema. Switching
+          modes rebuilds every stage.
+
+    Returns: list with the stages rebuilt
+    """
+    names = get_official_names()
+    manifest = read_manifest()
+    rebuilt = []
+
+    for stage in STAGE_VERSIONS:
+        inputs = stage_inputs(stage, names, compact)
+        is_current = (manifest.get(stage, {}).get("inputs") == inputs
+                      and clean_path(stage).exists()
+                      and STAGE_UPSTREAM.get(stage) not in rebuilt)
+        if is_current and not force:
+            continue
+
+        with metrics.track(f"clean.{stage}") as record:
+            df = build_stage(stage, chunksize, compact)
+            record["rows_out"] = len(df)
+            write_clean(df, stage, compact=compact)
+        manifest[stage] = {"inputs": inputs, "built_at": time.time()}
+        write_manifest(manifest)
+        rebuilt.append(stage)
+
+    return rebuilt
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
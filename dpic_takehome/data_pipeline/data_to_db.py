@@ -1,16 +1,71 @@
 import pandas as pd
 from ..data_pipeline import cleaning
+from ..data_pipeline.run_queries import LOAD_COMPLETE
+from .. import metrics
 import sqlite3
 from pathlib import Path
 import os
+import re
+import time
 
-def create_data_model(db_path = Path("data/dpic.db"), schema_path = Path("dpic_takehome/sql/schema.sql")):
+# Base table: summary table, query to compute it in SQLite, and the same
+# aggregation over the clean layer (group columns, measure, pyarrow function)
+SUMMARY_TABLES = {
+    'iti_enrollments': ('enrollment_summary',
+                        '''SELECT year, did, district, program, gender, SUM(enrolled)
+                           FROM iti_enrollments {where}
+                           GROUP BY year, did, district, program, gender''',
+                        (['year', 'did', 'district', 'program', 'gender'], 'enrolled', 'sum')),
+    'grievances': ('grievance_summary',
+                   '''SELECT year, did, district_name, cat_grivance, COUNT(grievance_text)
+                      FROM grievances {where}
+                      GROUP BY year, did, district_name, cat_grivance''',
+                   (['year', 'did', 'district_name', 'cat_grievance_text'], 'grievance_text', 'count')),
+}
+
+def create_data_model(db_path = Path("data/dpic.db"), schema_path = Path("dpic_takehome/sql/schema.sql"),
+                      incremental = False, compact = False):
+    '''
+    Function to create the tables of the data model. With incremental=True the
+    DROP statements are skipped, so existing rows are kept. With compact=True
+    the ids are declared as integers. The database is
+    switched to WAL, which is stored in the file, so the dashboard reads do not
+    block (or get blocked by) the loads.
+    '''
     con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode = WAL')
     with open(schema_path, 'r') as s:
-        con.executescript(s.read())
+        script = s.read()
+    if incremental:
+        script = re.sub(r"DROP TABLE IF EXISTS \w+;", "", script)
+    if compact:
+        # Ids are small integers in the compact schema
+        script = re.sub(r"\b(did|iid) char\(4\)", r"\1 smallint", script)
+    con.executescript(script)
     con.commit()
     con.close()
 
+def add_summary_fallbacks(con: sqlite3.Connection, schema_path = Path("dpic_takehome/sql/schema.sql")) -> list:
+    '''
+    Function to let the dashboard queries run on a database loaded before the
+    summary tables existed. Each missing summary table is computed from its
+    base table into a temporary table of this connection, which also works on
+    read-only connections and leaves the database file as it is. The next
+    load creates the real tables.
+
+    Returns: list with the summary tables that were missing
+    '''
+    missing = []
+    for summary, query, _ in SUMMARY_TABLES.values():
+        if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (summary,)).fetchone():
+            continue
+        with open(schema_path, 'r') as s:
+            create = re.search(rf'CREATE TABLE IF NOT EXISTS {summary}\(.*?\);', s.read(), re.S).group(0)
+        con.execute(create.replace('CREATE TABLE', 'CREATE TEMP TABLE'))
+        con.execute(f'INSERT INTO temp.{summary} ' + query.format(where=''))
+        missing.append(summary)
+    return missing
+
 def describre_tables(db_path = Path("data/dpic.db")):
     
     with sqlite3.connect(db_path) as con:
@@ -21,24 +76,268 @@ def describre_tables(db_path = Path("data/dpic.db")):
             for row in res:
                 print(row)
 
-def insert_data(db_path = Path("data/dpic.db")):
-    if len(os.listdir(Path('data/clean'))) != 4:
-        cleaning.main()
-    
-    tables = [file[:-4] for file in os.listdir(Path('data/clean')) if file.endswith('.csv')]
+def table_info(con: sqlite3.Connection, table: str) -> tuple[list, list]:
+    '''
+    Helper function to get the columns and primary key columns of a table
+    '''
+    info = con.execute(f'PRAGMA table_info({table})').fetchall()
+    columns = [row[1] for row in info]
+    pks = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5] > 0]
+    return columns, pks
+
+def sync_rows(con: sqlite3.Connection, table: str, df: pd.DataFrame) -> tuple[int, list]:
+    '''
+    Function to bring a table in line with df without reading it back. df is
+    loaded into a temporary table and compared in SQL, where stored rows are
+    only looked up through the primary key index. Incoming rows with no
+    identical stored row are inserted, replacing the stored row with the same
+    key, and stored rows whose key is gone from df are deleted. Keys are unique
+    on both sides, so the number of gone keys is known from the row counts and
+    stored rows are only scanned when there is at least one.
+
+    Args:
+        - con: connection to the database
+        - table: name of the table
+        - df: dataframe with the same columns as the table, as returned by sql_values
+
+    Returns: tuple with the number of rows written (new, changed and deleted)
+    and the list of (year, did) partitions they touch, empty for tables
+    without them
+    '''
+    columns, pks = table_info(con, table)
+    # IS also matches NULLs, which are allowed in the keys of grievances
+    same_key = ' AND '.join(f'i.{pk} IS {table}.{pk}' for pk in pks)
+    same_row = ' AND '.join(f'i.{col} IS {table}.{col}' for col in columns)
+
+    con.execute('DROP TABLE IF EXISTS temp.incoming')
+    con.execute(f'CREATE TEMP TABLE incoming AS SELECT * FROM {table} WHERE 0')
+    con.executemany(f'INSERT INTO incoming VALUES ({"?,"*(len(columns) - 1)}?)', df.values.tolist())
+    con.execute('DROP TABLE IF EXISTS temp.changed')
+    con.execute(f'''CREATE TEMP TABLE changed AS SELECT * FROM incoming i
+                   WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {same_row})''')
+
+    # Stored rows to delete: the ones replaced by a changed row, and the ones
+    # whose key is gone, which are the stored rows not matched by an incoming key
+    con.execute('DROP TABLE IF EXISTS temp.outdated')
+    con.execute(f'''CREATE TEMP TABLE outdated AS SELECT {table}.rowid AS id
+                   FROM changed i JOIN {table} ON {same_key}''')
+    n_changed = con.execute('SELECT COUNT(*) FROM changed').fetchone()[0]
+    n_replaced = con.execute('SELECT COUNT(*) FROM outdated').fetchone()[0]
+    n_stored = con.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    n_gone = n_stored - (len(df) - (n_changed - n_replaced))
+    if n_gone:
+        con.execute(f'CREATE INDEX temp.idx_incoming ON incoming ({", ".join(pks)})')
+        con.execute(f'''INSERT INTO outdated SELECT rowid FROM {table}
+                       WHERE NOT EXISTS (SELECT 1 FROM incoming i WHERE {same_key})''')
+
+    partitions = []
+    if table in SUMMARY_TABLES:
+        partitions = con.execute(f'''SELECT year, did FROM {table} WHERE rowid IN outdated
+                                    UNION SELECT year, did FROM changed''').fetchall()
+    con.execute(f'DELETE FROM {table} WHERE rowid IN outdated')
+    con.execute(f'INSERT INTO {table} SELECT * FROM changed')
+    for temp in ['outdated', 'changed', 'incoming']:
+        con.execute(f'DROP TABLE temp.{temp}')
+    return n_changed + n_gone, partitions
+
+def upsert_rows(con: sqlite3.Connection, table: str, df: pd.DataFrame) -> int:
+    '''
+    Helper function to insert new rows and update changed ones using the
+    primary key of the table
+
+    Returns: number of rows written
+    '''
+    columns, pks = table_info(con, table)
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col not in pks)
+    query = f'''INSERT INTO {table} ({", ".join(columns)}) VALUES ({"?,"*(len(columns) - 1)}?)
+                ON CONFLICT ({", ".join(pks)}) DO UPDATE SET {updates}'''
+    rows = df.astype(object).where(df.notna(), None).values.tolist()
+    con.executemany(query, rows)
+    return len(rows)
+
+def record_watermark(con: sqlite3.Connection, table: str, rows_written: int):
+    '''
+    Helper function to record when a table was loaded and how many rows changed
+    '''
+    rows_total = con.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    con.execute('''INSERT INTO load_watermark (table_name, loaded_at, rows_written, rows_total)
+                   VALUES (?, ?, ?, ?)''', (table, time.time(), rows_written, rows_total))
+
+def record_load_complete(con: sqlite3.Connection, rows_written: int):
+    '''
+    Helper function to record that a load finished with every table in place.
+    The database version read by the dashboard and the query cache only
+    changes with these rows, so a load in progress is never picked up.
+    '''
+    con.execute('''INSERT INTO load_watermark (table_name, loaded_at, rows_written, rows_total)
+                   VALUES (?, ?, ?, NULL)''', (LOAD_COMPLETE, time.time(), rows_written))
+
+def set_bulk_pragmas(con: sqlite3.Connection):
+    '''
+    Helper function to tune SQLite for a bulk load: a 64MB page cache,
+    temporary structures in memory and no fsync. These only last as long as
+    the connection; the journal mode is set once by create_data_model.
+    '''
+    con.execute('PRAGMA cache_size = -65536')
+    con.execute('PRAGMA temp_store = MEMORY')
+    con.execute('PRAGMA synchronous = OFF')
+
+def drop_indexes(con: sqlite3.Connection, table: str) -> list:
+    '''
+    Helper function to drop the secondary indexes of a table
 
+    Returns: list with the statements needed to create them again
+    '''
+    indexes = con.execute('''SELECT name, sql FROM sqlite_master
+                             WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL''', (table,)).fetchall()
+    for name, _ in indexes:
+        con.execute(f'DROP INDEX {name}')
+    return [sql for _, sql in indexes]
+
+def sql_values(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Helper function to convert the dtypes of the clean layer to the values
+    stored in the database: dates are stored as 'YYYY-MM-DD' text, and
+    categoricals and nullable integers of the compact schema as plain values
+    '''
+    for col in df.select_dtypes('datetime').columns:
+        # Formatted by numpy, much faster than strftime
+        dates = df[col].values.astype('datetime64[D]').astype(str)
+        df[col] = pd.Series(dates, index=df.index).where(df[col].notna(), None)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.api.extensions.ExtensionDtype):
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df
+
+def bulk_load(con: sqlite3.Connection, table: str, batch_size: int = 50_000) -> int:
+    '''
+    Function to stream a clean table into the database in batches. Each batch
+    is one transaction and secondary indexes are built once all rows are in,
+    or if the load fails.
+
+    Args:
+        - con: connection to the database
+        - table: name of the table
+        - batch_size: maximum number of rows per transaction
+
+    Returns: number of rows loaded
+    '''
+    indexes = drop_indexes(con, table)
+    con.commit()
+
+    n_rows = 0
+    try:
+        for chunk in cleaning.iter_clean(table, batch_size):
+            metrics.add("rows_in", len(chunk))
+            chunk = sql_values(chunk)
+            with con:
+                con.executemany(f'''INSERT INTO {table} VALUES ({"?,"*(len(chunk.columns) - 1)}?)''',
+                                chunk.values.tolist())
+            n_rows += len(chunk)
+    finally:
+        with con:
+            for sql in indexes:
+                con.execute(sql)
+    return n_rows
+
+def refresh_summary(con: sqlite3.Connection, table: str, partitions: list | None = None):
+    '''
+    Function to update the summary table fed by a base table. Only the given
+    (year, did) partitions are recomputed, or the whole summary if partitions
+    is None or the summary is still empty.
+
+    Args:
+        - con: connection to the database
+        - table: name of the base table
+        - partitions: list of (year, did) tuples touched by the last load
+    '''
+    summary, query, _ = SUMMARY_TABLES[table]
+    is_empty = con.execute(f'SELECT COUNT(*) FROM {summary}').fetchone()[0] == 0
+    if partitions is None or is_empty:
+        con.execute(f'DELETE FROM {summary}')
+        con.execute(f'INSERT INTO {summary} ' + query.format(where=''))
+        return
+
+    for year, did in partitions:
+        con.execute(f'DELETE FROM {summary} WHERE year IS ? AND did IS ?', (year, did))
+        con.execute(f'INSERT INTO {summary} ' + query.format(where='WHERE year IS ? AND did IS ?'), (year, did))
+
+def bulk_summary(con: sqlite3.Connection, table: str):
+    '''
+    Function to rebuild the summary table fed by a base table straight from
+    the clean layer. pyarrow groups the rows much faster than SQLite, and
+    only the group and measure columns are read.
+
+    Args:
+        - con: connection to the database
+        - table: name of the base table
+    '''
+    summary, _, (keys, measure, how) = SUMMARY_TABLES[table]
+    grouped = (cleaning.clean_dataset(table).to_table(columns=[*keys, measure])
+               .group_by(keys).aggregate([(measure, how)]))
+    rows = sql_values(grouped.select([*keys, f'{measure}_{how}']).to_pandas())
+    con.execute(f'DELETE FROM {summary}')
+    con.executemany(f'INSERT INTO {summary} VALUES ({"?,"*len(keys)}?)', rows.values.tolist())
+
+def insert_data(db_path = Path("data/dpic.db"), incremental = False, bulk = False, compact = False):
+    '''
+    Function to load the clean tables into the database. With incremental=True only
+    new, changed and deleted rows are written, through sync_rows.
+    With bulk=True a full reload goes through bulk_load and records rows per second,
+    and the summaries are rebuilt from the clean layer with bulk_summary.
+    The summary tables read by the dashboard queries are refreshed after each load,
+    and the end of the whole load is recorded with record_load_complete.
+    compact=True loads the clean layer built in the compact schema.
+    '''
+    # Cheap when nothing changed: only stages with new inputs are rebuilt
+    cleaning.main(compact = compact)
+
+    tables = [file.removesuffix('.parquet') for file in os.listdir(Path('data/clean'))]
+
+    rows_total = 0
     with sqlite3.connect(db_path) as con:
         cur = con.cursor()
+        bulk = bulk and not incremental
+        if bulk:
+            set_bulk_pragmas(con)
 
         for table in tables:
-            df = pd.read_csv(Path(f'data/clean/{table}.csv'))
+            with metrics.track(f'load.{table}') as record:
+                if bulk:
+                    start = time.perf_counter()
+                    rows_written = bulk_load(con, table)
+                    record['rows_per_second'] = round(rows_written / (time.perf_counter() - start))
+                else:
+                    df = sql_values(cleaning.read_clean(table))
+                    record['rows_in'] = len(df)
+                    if incremental:
+                        df.columns = table_info(con, table)[0]
+                        rows_written, partitions = sync_rows(con, table, df)
+                    else:
+                        cur.executemany(f'''INSERT INTO {table} VALUES ({"?,"*(len(df.columns) - 1)}?)''', df.values.tolist())
+                        rows_written = len(df)
+                record['rows_out'] = rows_written
+
+            if table in SUMMARY_TABLES:
+                if not incremental:
+                    partitions = None
+                with metrics.track(f'summary.{SUMMARY_TABLES[table][0]}', rows_in=None if partitions is None else len(partitions)):
+                    if bulk:
+                        bulk_summary(con, table)
+                    else:
+                        refresh_summary(con, table, partitions)
+            record_watermark(con, table, rows_written)
+            con.commit()
+            rows_total += rows_written
 
-            cur.executemany(f'''INSERT INTO {table} VALUES ({"?,"*(len(df.columns) - 1)}?)''', df.values.tolist())
+        # A load that wrote nothing keeps the database version, and the caches built on it
+        if rows_total:
+            record_load_complete(con, rows_total)
             con.commit()
 
-def main(describre = False):
-    create_data_model()
-    insert_data()
+def main(describre = False, incremental = False, bulk = False, compact = False):
+    create_data_model(incremental = incremental, compact = compact)
+    insert_data(incremental = incremental, bulk = bulk, compact = compact)
     if describre:
         describre_tables()
 
@@ -0,0 +1,298 @@
+import json
+import time
+import shutil
+import sqlite3
+import pandas as pd
+from pathlib import Path
+from ..data_pipeline import cleaning, data_to_db
+from .. import metrics
+
+PATH_DB = Path("data/dpic.db")
+PATH_SNAPSHOTS = Path("data/cache/raw_snapshots")
+PATH_DELTA_STATS = Path("data/cache/delta_stats.json")
+DELTA_STAGES = {
+    "grievances": {"keys": cleaning.GRIEVANCES_KEYS, "clean_chunk": cleaning.clean_grievances_chunk,
+                   "how": "max", "agg_var": "resolved"},
+    "iti_enrollments": {"keys": cleaning.ITI_ENROLLMENTS_KEYS, "clean_chunk": cleaning.clean_iti_enrollments_chunk,
+                        "how": "sum", "agg_var": "enrolled"},
+}
+ROW_ID = ["_row_hash", "_row_n"]
+
+
+def read_raw(stage: str) -> pd.DataFrame:
+    '''
+    Helper function to read a raw file and identify each record by the hash
+    of all its fields (plus its occurrence number, so repeated records are
+    kept apart) and by the hash of its natural key
+
+    Args:
+        - stage: name of the clean table built from the raw file
+
+    Returns: pd.DataFrame with the raw records and the _row_hash, _row_n and
+    _key_hash columns
+    '''
+    raw = next(cleaning.read_chunks(cleaning.STAGE_RAW[stage]))
+    keys = [col for col in DELTA_STAGES[stage]["keys"] if col in raw.columns]
+    text = raw.astype(str)
+    raw["_row_hash"] = pd.util.hash_pandas_object(text, index=False).values
+    raw["_key_hash"] = pd.util.hash_pandas_object(text[keys], index=False).values
+    raw["_row_n"] = raw.groupby("_row_hash").cumcount()
+    return raw
+
+
+def read_snapshot(stage: str, snapshot_dir: Path = PATH_SNAPSHOTS) -> pd.DataFrame | None:
+    '''
+    Helper function to read the row-level snapshot of the previous raw drop:
+    each raw record after the row-level cleaning, before deduplication
+
+    Returns: pd.DataFrame, or None if there is no snapshot yet
+    '''
+    path = snapshot_dir / f"{stage}.parquet"
+    if not path.exists():
+        return None
+    return pd.read_parquet(path)
+
+
+def write_snapshot(rows: pd.DataFrame, stage: str, snapshot_dir: Path = PATH_SNAPSHOTS):
+    '''
+    Helper function to save the row-level snapshot of the current raw drop
+    '''
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    rows.to_parquet(snapshot_dir / f"{stage}.parquet", index=False)
+
+
+def is_stale(stage: str, compact: bool = False) -> bool:
+    '''
+    Helper function to check whether the clean layer of a stage was built with
+    other cleaning logic than the current one (stage version, official names,
+    schema mode or classifier). A delta on top of it would mix rows of both,
+    so it has to be rebuilt in full. The raw file is left out: a new raw drop
+    is what a delta applies. compact is the schema mode of the current run.
+    '''
+    built = cleaning.read_manifest().get(stage, {}).get("inputs", {})
+    current = cleaning.stage_inputs(stage, cleaning.get_official_names(), compact)
+    return ({key: value for key, value in built.items() if key != "raw"}
+            != {key: value for key, value in current.items() if key != "raw"})
+
+
+def clean_rows(stage: str, raw: pd.DataFrame, compact: bool = False) -> pd.DataFrame:
+    '''
+    Helper function to apply the row-level cleaning of a stage to raw records
+    '''
+    return DELTA_STAGES[stage]["clean_chunk"](raw.copy(), compact).infer_objects()
+
+
+def split_delta(raw: pd.DataFrame, previous: pd.DataFrame) -> tuple:
+    '''
+    Helper function to compare the new raw drop with the previous snapshot
+
+    Returns: tuple with the raw records not seen before, the previous rows
+    still present and the previous rows that are gone
+    '''
+    is_seen = pd.MultiIndex.from_frame(raw[ROW_ID]).isin(pd.MultiIndex.from_frame(previous[ROW_ID]))
+    is_kept = pd.MultiIndex.from_frame(previous[ROW_ID]).isin(pd.MultiIndex.from_frame(raw[ROW_ID]))
+    return raw[~is_seen], previous[is_kept], previous[~is_kept]
+
+
+def delta_stats(added: pd.DataFrame, removed: pd.DataFrame) -> dict:
+    '''
+    Helper function to count records by natural key: a key with both added
+    and removed records was changed
+
+    Returns: dict with the number of new, changed and deleted records
+    '''
+    added_keys, removed_keys = set(added["_key_hash"]), set(removed["_key_hash"])
+    return {
+        "new": len(added_keys - removed_keys),
+        "changed": len(added_keys & removed_keys),
+        "deleted": len(removed_keys - added_keys),
+    }
+
+
+def key_mask(df: pd.DataFrame, keys_df: pd.DataFrame, keys: list) -> pd.Series:
+    '''
+    Helper function to flag the rows of df whose natural key is in keys_df
+    '''
+    return pd.MultiIndex.from_frame(df[keys]).isin(pd.MultiIndex.from_frame(keys_df[keys]))
+
+
+def recompute(stage: str, rows: pd.DataFrame, affected: pd.DataFrame, compact: bool = False) -> pd.DataFrame:
+    '''
+    Function to deduplicate again only the natural keys touched by the delta,
+    from all the rows that share them
+
+    Args:
+        - stage: name of the clean table
+        - rows: row-level snapshot of the current raw drop
+        - affected: natural keys of the added and removed records
+        - compact: build the rows in the compact schema
+
+    Returns: pd.DataFrame with the clean rows of the affected keys
+    '''
+    spec = DELTA_STAGES[stage]
+    rows = rows[key_mask(rows, affected, spec["keys"])].copy()
+    df = cleaning.handle_duplicates(rows, spec["keys"], spec["how"], spec["agg_var"])
+    if stage == "grievances":
+        return cleaning.finish_grievances(df, compact)
+
+    return cleaning.finish_iti_enrollments(df, add_itis(df["institute_name"].unique(), compact), compact)
+
+
+def add_itis(names, compact: bool = False) -> pd.DataFrame:
+    '''
+    Helper function to give ids to the ITIs not seen before, after the
+    largest id in use, so ids already stored never change
+
+    Args:
+        - names: names of the ITIs of the clean rows
+        - compact: give the new ITIs ids of the compact schema
+
+    Returns: pd.DataFrame with the iid and name of every ITI
+    '''
+    if cleaning.clean_path("itis").exists():
+        itis = cleaning.read_clean("itis")
+    else:
+        itis = pd.DataFrame({"iid": pd.Series(dtype=object), "name": pd.Series(dtype=object)})
+    new_names = [name for name in names if name not in set(itis["name"])]
+    if new_names:
+        start = int(itis["iid"].max()) if len(itis) else 0
+        new_itis = cleaning.gen_ids(new_names, "iid", start, compact)
+        # Without stored ITIs the new ones keep the dtype of gen_ids
+        itis = pd.concat([itis, new_itis], ignore_index=True) if len(itis) else new_itis
+        cleaning.write_clean(itis, "itis", compact=compact)
+    return itis
+
+
+def apply_to_clean(stage: str, recomputed: pd.DataFrame, affected: pd.DataFrame,
+                   compact: bool = False) -> pd.DataFrame:
+    '''
+    Function to replace the rows of the affected keys in the clean layer. Only
+    the year partitions holding affected keys are read and rewritten.
+
+    Returns: pd.DataFrame with the rows taken out of the clean layer
+    '''
+    keys = DELTA_STAGES[stage]["keys"]
+    # Keys without a year were never in the clean layer (see handle_duplicates)
+    years = affected["year"].dropna().unique().tolist()
+    current = cleaning.read_clean(stage, years=years)
+    is_affected = key_mask(current, affected, keys)
+    # Empty parts are left out, so they do not change the dtypes of the result
+    parts = [part for part in (current[~is_affected], recomputed[current.columns]) if len(part)]
+    updated = pd.concat(parts, ignore_index=True) if parts else current.iloc[:0]
+
+    cleaning.write_clean(updated, stage, replace=False, compact=compact)
+    for year in set(years) - set(updated["year"]):
+        shutil.rmtree(cleaning.clean_path(stage) / f"year={year}", ignore_errors=True)
+    return current[is_affected]
+
+
+def apply_to_db(con: sqlite3.Connection, stage: str, recomputed: pd.DataFrame,
+                removed: pd.DataFrame) -> int:
+    '''
+    Function to upsert the recomputed rows, delete the keys that are gone and
+    refresh the summary partitions they touch
+
+    Args:
+        - con: connection to the database
+        - stage: name of the table
+        - recomputed: clean rows of the affected keys
+        - removed: rows taken out of the clean layer
+
+    Returns: number of rows written
+    '''
+    columns, pks = data_to_db.table_info(con, stage)
+    keys = DELTA_STAGES[stage]["keys"]
+    gone = removed[~key_mask(removed, recomputed, keys)]
+
+    rows = data_to_db.sql_values(recomputed[removed.columns].copy())
+    gone = data_to_db.sql_values(gone.copy())
+    rows.columns, gone.columns = columns, columns
+
+    rows_written = data_to_db.upsert_rows(con, stage, rows)
+    where = " AND ".join(f"{pk} IS ?" for pk in pks)
+    con.executemany(f"DELETE FROM {stage} WHERE {where}", gone[pks].astype(object).values.tolist())
+
+    if stage == "iti_enrollments":
+        data_to_db.upsert_rows(con, "itis", cleaning.read_clean("itis"))
+
+    partitions = pd.concat([rows[["year", "did"]], gone[["year", "did"]]]).drop_duplicates()
+    partitions = partitions.astype(object).where(partitions.notna(), None)
+    data_to_db.refresh_summary(con, stage, list(partitions.itertuples(index=False, name=None)))
+    data_to_db.record_watermark(con, stage, rows_written + len(gone))
+    return rows_written + len(gone)
+
+
+def update_manifest(stages: list, compact: bool = False):
+    '''
+    Helper function to record the current inputs of the stages updated by a
+    delta, so cleaning.main does not rebuild them again
+    '''
+    names = cleaning.get_official_names()
+    manifest = cleaning.read_manifest()
+    for stage in stages:
+        manifest[stage] = {"inputs": cleaning.stage_inputs(stage, names, compact), "built_at": time.time()}
+    cleaning.write_manifest(manifest)
+
+
+def main(db_path: Path = PATH_DB, compact: bool = False) -> dict:
+    '''
+    Function to bring the clean layer and the database up to date with the
+    raw files. Each raw drop is compared record by record with the previous
+    one: only new, changed and deleted records are cleaned and loaded. The
+    first run (without snapshots) and runs after the cleaning logic or the
+    schema mode changed (see is_stale) clean and load everything.
+
+    Args:
+        - db_path: Path object of the database
+        - compact: keep the clean layer and the database in the compact schema
+
+    Returns: dict with the number of new, changed and deleted records and the
+    rows written for each source
+    '''
+    raws = {stage: read_raw(stage) for stage in DELTA_STAGES}
+    previous = {stage: read_snapshot(stage) for stage in DELTA_STAGES}
+    stats = {}
+
+    if (any(snapshot is None for snapshot in previous.values())
+            or any(is_stale(stage, compact) for stage in DELTA_STAGES)):
+        cleaning.main(compact=compact)
+        data_to_db.main(compact=compact)
+        with sqlite3.connect(db_path) as con:
+            for stage, raw in raws.items():
+                rows_total = con.execute(f"SELECT COUNT(*) FROM {stage}").fetchone()[0]
+                stats[stage] = {"new": int(raw["_key_hash"].nunique()), "changed": 0,
+                                "deleted": 0, "rows_written": rows_total}
+                write_snapshot(clean_rows(stage, raw, compact), stage)
+    else:
+        for stage, raw in raws.items():
+            with metrics.track(f"delta.{stage}", rows_in=len(raw)) as record:
+                added, kept, removed = split_delta(raw, previous[stage])
+                stats[stage] = delta_stats(added, removed)
+                added = clean_rows(stage, added, compact) if len(added) else kept.iloc[:0]
+                rows = pd.concat([kept, added], ignore_index=True)
+
+                rows_written = 0
+                if len(added) or len(removed):
+                    keys = DELTA_STAGES[stage]["keys"]
+                    affected = pd.concat([added[keys], removed[keys]]).drop_duplicates()
+                    recomputed = recompute(stage, rows, affected, compact)
+                    taken_out = apply_to_clean(stage, recomputed, affected, compact)
+                    with sqlite3.connect(db_path) as con:
+                        rows_written = apply_to_db(con, stage, recomputed, taken_out)
+                    write_snapshot(rows, stage)
+                    update_manifest(["iti_enrollments", "itis"] if stage == "iti_enrollments" else [stage], compact)
+                stats[stage]["rows_written"] = record["rows_out"] = rows_written
+
+        rows_total = sum(source["rows_written"] for source in stats.values())
+        if rows_total:
+            with sqlite3.connect(db_path) as con:
+                data_to_db.record_load_complete(con, rows_total)
+
+    PATH_DELTA_STATS.parent.mkdir(parents=True, exist_ok=True)
+    with open(PATH_DELTA_STATS, "w") as f:
+        json.dump({"computed_at": time.time(), "sources": stats}, f, indent=2)
+    return stats
+
+
+if __name__ == "__main__":
+    print(main())
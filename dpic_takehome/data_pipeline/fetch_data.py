@@ -1,22 +1,174 @@
-import requests
+import os
+import json
+import time
+import argparse
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def main():
-    url_1 = "https://raw.githubusercontent.com/cesarnunezh/dpic-takehome-assignment/refs/heads/main/data/raw/grievances.json?token=GHSAT0AAAAAAC44UUVR2BQOJL4PD6RA452CZ752J6Q"
-    url_2 = "https://raw.githubusercontent.com/cesarnunezh/dpic-takehome-assignment/refs/heads/main/data/raw/iti_enrollments.csv?token=GHSAT0AAAAAAC44UUVRXVOEQJKSDTQERVTWZ752KLQ"
+SOURCES = {
+    Path("data/raw/grievances.json"): "https://raw.githubusercontent.com/cesarnunezh/dpic-takehome-assignment/refs/heads/main/data/raw/grievances.json?token=GHSAT0AAAAAAC44UUVR2BQOJL4PD6RA452CZ752J6Q",
+    Path("data/raw/iti_enrollments.csv"): "https://raw.githubusercontent.com/cesarnunezh/dpic-takehome-assignment/refs/heads/main/data/raw/iti_enrollments.csv?token=GHSAT0AAAAAAC44UUVRXVOEQJKSDTQERVTWZ752KLQ",
+}
+PATH_FETCH_STATE = Path("data/cache/fetch")
+CHUNK_SIZE = 1 << 16
+MAX_RETRIES = 4
+BACKOFF = 0.5
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
-    path_1 = Path("data/raw/grievances.json")
-    path_2 = Path("data/raw/iti_enrollments.csv")
 
-    response1, response2 = requests.get(url_1) , requests.get(url_2)
-    response1.raise_for_status()
-    response2.raise_for_status()
+def state_path(path: Path, state_dir: Path = PATH_FETCH_STATE) -> Path:
+    '''
+    Helper function to get where the validators (ETag, Last-Modified) of a
+    downloaded file are kept
+    '''
+    return state_dir / f"{path.name}.json"
+
+
+def read_state(path: Path, state_dir: Path = PATH_FETCH_STATE) -> dict:
+    '''
+    Helper function to read the validators of the last download of a file and
+    of its partial download, if any
+    '''
+    if not state_path(path, state_dir).exists():
+        return {}
+    with open(state_path(path, state_dir), "r") as f:
+        return json.load(f)
+
+
+def write_state(path: Path, state: dict, state_dir: Path = PATH_FETCH_STATE):
+    '''
+    Helper function to save the validators of a file
+    '''
+    state_dir.mkdir(parents=True, exist_ok=True)
+    with open(state_path(path, state_dir), "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def validators(response: httpx.Response) -> dict:
+    '''
+    Helper function to keep the headers that identify a version of a file
+    '''
+    return {"etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified")}
+
+
+def request_headers(path: Path, part: Path, url: str, state: dict) -> dict:
+    '''
+    Helper function to build the headers of a download: a Range request
+    (only valid if the file did not change, through If-Range) to resume a
+    partial download, or a conditional request to skip an unchanged file
+
+    Args:
+        - path: Path object where the file is saved
+        - part: Path object of the partial download
+        - url: url of the file
+        - state: validators from read_state
+
+    Returns: dict with the headers
+    '''
+    # Byte ranges refer to the encoded body, so ask for the file as it is
+    headers = {"Accept-Encoding": "identity"}
+    partial = state.get("partial", {})
+    if part.exists() and partial.get("url") == url:
+        validator = partial.get("etag") or partial.get("last_modified")
+        if validator:
+            headers["Range"] = f"bytes={part.stat().st_size}-"
+            headers["If-Range"] = validator
+    elif path.exists() and state.get("url") == url:
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+    return headers
+
+
+def download(client: httpx.Client, url: str, path: Path, max_retries: int = MAX_RETRIES,
+             backoff: float = BACKOFF, state_dir: Path = PATH_FETCH_STATE) -> str:
+    '''
+    Function to download a file to disk in chunks. The body is written to a
+    .part file that replaces the file only once complete, so an interrupted
+    download is resumed by the next attempt or the next run. Connection
+    errors and 429/5xx responses are retried with exponential backoff.
+
+    Args:
+        - client: httpx.Client shared by the downloads
+        - url: url of the file
+        - path: Path object where the file is saved
+        - max_retries: number of retries after the first attempt
+        - backoff: seconds to wait before the first retry, doubled each time
+        - state_dir: Path object where the validators are kept
+
+    Returns: 'downloaded', 'resumed' or 'not modified'
+    '''
+    part = path.with_name(path.name + ".part")
+    for attempt in range(max_retries + 1):
+        state = read_state(path, state_dir)
+        headers = request_headers(path, part, url, state)
+        try:
+            with client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    return "not modified"
+                if response.status_code == 416:
+                    # The partial download does not fit the file anymore
+                    part.unlink(missing_ok=True)
+                    continue
+                if response.status_code in RETRY_STATUS:
+                    raise httpx.HTTPStatusError("Retryable status", request=response.request, response=response)
+                response.raise_for_status()
+
+                resumed = response.status_code == 206
+                # An encoded body is decoded on the fly, so it cannot be resumed
+                is_encoded = response.headers.get("content-encoding", "identity") != "identity"
+                if not resumed:
+                    state["partial"] = {"url": url, **validators(response)}
+                    if is_encoded:
+                        state["partial"].update(etag=None, last_modified=None)
+                    write_state(path, state, state_dir)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                chunks = response.iter_bytes(CHUNK_SIZE) if is_encoded else response.iter_raw(CHUNK_SIZE)
+                with open(part, "ab" if resumed else "wb") as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+
+            os.replace(part, path)
+            write_state(path, {"url": url, **state.pop("partial")}, state_dir)
+            return "resumed" if resumed else "downloaded"
+
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            is_retryable = (isinstance(e, httpx.TransportError)
+                            or e.response.status_code in RETRY_STATUS)
+            if not is_retryable or attempt == max_retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+    raise RuntimeError(f"Could not download {url}")
+
+
+def main(sources: dict = SOURCES, max_workers: int = 4, timeout: float = 30) -> dict:
+    '''
+    Function to download the raw files concurrently
+
+    Args:
+        - sources: dict mapping the Path of each file to its url
+        - max_workers: maximum number of downloads at the same time
+        - timeout: seconds to wait for the server before retrying
+
+    Returns: dict with the outcome of each download
+    '''
+    with httpx.Client(follow_redirects=True, timeout=timeout) as client:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {path: executor.submit(download, client, url, path)
+                       for path, url in sources.items()}
+            return {str(path): future.result() for path, future in futures.items()}
 
-    with open(path_1, "wb") as g:
-        g.write(response1.content)
-    
-    with open(path_2, "wb") as i:
-        i.write(response2.content)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download the raw files")
+    parser.add_argument("--base-url", help="download the files from this server instead (e.g. a local stand-in)")
+    args = parser.parse_args()
+
+    sources = SOURCES
+    if args.base_url:
+        sources = {path: f"{args.base_url.rstrip('/')}/{path.name}" for path in SOURCES}
+    print(main(sources))
@@ -0,0 +1,259 @@
+import json
+import time
+import shutil
+import sqlite3
+import pandas as pd
+from pathlib import Path
+from ..data_pipeline import cleaning, data_to_db, delta
+from .. import metrics
+
+PATH_DB = Path("data/dpic.db")
+PATH_PENDING = Path("data/cache/pending")
+DISTRICT_COLS = {"grievances": "district_name", "iti_enrollments": "district"}
+# Year tasks of both sources may write at the same time: wait for the lock
+DB_TIMEOUT = 120
+
+
+def pending_path(stage: str, name: str, pending_dir: Path = PATH_PENDING) -> Path:
+    '''
+    Helper function to get where the plan of a source keeps its files until
+    every year partition is loaded
+    '''
+    return pending_dir / stage / name
+
+
+def clean_years(stage: str) -> list:
+    '''
+    Helper function to get the year partitions stored in the clean layer
+    '''
+    path = cleaning.clean_path(stage)
+    if not path.exists():
+        return []
+    return sorted(int(p.name.removeprefix("year=")) for p in path.glob("year=*"))
+
+
+def prepare(db_path: Path = PATH_DB, compact: bool = False):
+    '''
+    Function to create the missing tables of the database and to store the
+    districts, which every year partition refers to. If a source was built
+    with other cleaning logic or schema mode (see delta.is_stale), its rows
+    cannot be mixed with new ones: the snapshots, the clean tables and the
+    tables of the database are dropped, so every source is planned and loaded
+    in full. compact is the schema mode of the run, and every task of the run
+    must get the same one.
+    '''
+    if any(delta.is_stale(stage, compact) for stage in delta.DELTA_STAGES):
+        for stage in delta.DELTA_STAGES:
+            (delta.PATH_SNAPSHOTS / f"{stage}.parquet").unlink(missing_ok=True)
+        for stage in delta.DELTA_STAGES:
+            shutil.rmtree(cleaning.clean_path(stage), ignore_errors=True)
+        cleaning.clean_path("itis").unlink(missing_ok=True)
+        data_to_db.create_data_model(db_path, compact=compact)
+    else:
+        data_to_db.create_data_model(db_path, incremental=True, compact=compact)
+
+    districts = cleaning.build_stage("districts", compact=compact)
+    cleaning.write_clean(districts, "districts", compact=compact)
+    with sqlite3.connect(db_path, timeout=DB_TIMEOUT) as con:
+        data_to_db.upsert_rows(con, "districts", districts)
+    delta.update_manifest(["districts"], compact)
+
+
+def plan(stage: str, db_path: Path = PATH_DB, compact: bool = False) -> dict:
+    '''
+    Function to compare the new raw file of a source with the previous drop and
+    to find the year partitions it touches. The new row-level snapshot and the
+    natural keys to recompute are kept in PATH_PENDING, so each year can be
+    cleaned and loaded (and retried) on its own. Without a previous snapshot
+    every year is rebuilt from scratch. New ITIs get their ids here, before
+    the years run in parallel. A source built with other cleaning logic or
+    schema mode is also rebuilt from scratch.
+
+    Args:
+        - stage: name of the clean table built from the raw file
+        - db_path: Path object of the database
+        - compact: schema mode of the run
+
+    Returns: dict with the number of new, changed and deleted records and the
+    list of years to process
+    '''
+    keys = delta.DELTA_STAGES[stage]["keys"]
+    raw = delta.read_raw(stage)
+    # A stale clean layer is rebuilt in full (prepare already dropped it)
+    previous = None if delta.is_stale(stage, compact) else delta.read_snapshot(stage)
+
+    with metrics.track(f"plan.{stage}", rows_in=len(raw)) as record:
+        if previous is None:
+            rows = delta.clean_rows(stage, raw, compact)
+            affected = rows[keys].drop_duplicates()
+            stats = {"new": int(raw["_key_hash"].nunique()), "changed": 0, "deleted": 0}
+            # Years gone from the raw file are emptied in the clean layer and the db
+            with sqlite3.connect(db_path, timeout=DB_TIMEOUT) as con:
+                stored = [year for (year,) in con.execute(f"SELECT DISTINCT year FROM {stage}")]
+            years = set(affected["year"]) | set(clean_years(stage)) | set(stored)
+        else:
+            added, kept, removed = delta.split_delta(raw, previous)
+            stats = delta.delta_stats(added, removed)
+            added = delta.clean_rows(stage, added, compact) if len(added) else kept.iloc[:0]
+            rows = pd.concat([kept, added], ignore_index=True)
+            affected = pd.concat([added[keys], removed[keys]]).drop_duplicates()
+            years = set(affected["year"])
+        record["rows_out"] = len(affected)
+
+    if stage == "iti_enrollments":
+        delta.add_itis(rows["institute_name"].unique(), compact)
+        with sqlite3.connect(db_path, timeout=DB_TIMEOUT) as con:
+            data_to_db.upsert_rows(con, "itis", cleaning.read_clean("itis"))
+
+    shutil.rmtree(pending_path(stage, ""), ignore_errors=True)
+    pending_path(stage, "").mkdir(parents=True)
+    rows.to_parquet(pending_path(stage, "rows.parquet"), index=False)
+    affected.to_parquet(pending_path(stage, "affected.parquet"), index=False)
+    with open(pending_path(stage, "plan.json"), "w") as f:
+        json.dump({"full": previous is None, "stats": stats, "planned_at": time.time()}, f, indent=2)
+
+    # Records without a date have no year: handle_duplicates drops them
+    return {**stats, "years": sorted(int(year) for year in years if pd.notna(year))}
+
+
+def clean_year(stage: str, year: int, compact: bool = False) -> dict:
+    '''
+    Function to rebuild one year partition of the clean layer from the plan:
+    the rows of the affected keys are recomputed and replace the stored ones.
+    Running it again gives the same partition.
+
+    Args:
+        - stage: name of the clean table
+        - year: year of the partition
+        - compact: schema mode of the run
+
+    Returns: dict with the stage, the year and the (year, did) summary
+    partitions touched (None to refresh the whole year), to be passed to
+    load_year
+    '''
+    with open(pending_path(stage, "plan.json")) as f:
+        is_full = json.load(f)["full"]
+    keys = delta.DELTA_STAGES[stage]["keys"]
+    rows = pd.read_parquet(pending_path(stage, "rows.parquet"), filters=[("year", "==", year)])
+    affected = pd.read_parquet(pending_path(stage, "affected.parquet"), filters=[("year", "==", year)])
+
+    with metrics.track(f"clean.{stage}.{year}", rows_in=len(rows)) as record:
+        recomputed = delta.recompute(stage, rows, affected, compact)
+        if is_full or year not in clean_years(stage):
+            updated = recomputed
+        else:
+            current = cleaning.read_clean(stage, years=[year])
+            is_affected = delta.key_mask(current, affected, keys)
+            # Empty parts are left out, so they do not change the dtypes of the result
+            parts = [part for part in (current[~is_affected], recomputed[current.columns]) if len(part)]
+            updated = pd.concat(parts, ignore_index=True) if parts else current.iloc[:0]
+
+        if len(updated):
+            cleaning.write_clean(updated, stage, replace=False, compact=compact)
+        else:
+            shutil.rmtree(cleaning.clean_path(stage) / f"year={year}", ignore_errors=True)
+        record["rows_out"] = len(updated)
+
+    if is_full:
+        return {"stage": stage, "year": year, "touched": None}
+
+    # The touched districts come from the plan, so a retry reports the same ones
+    districts = cleaning.gen_ids(cleaning.get_official_names(), "did", compact=compact)
+    dids = cleaning.assign_ids(affected[DISTRICT_COLS[stage]], districts, "did").drop_duplicates()
+    touched = [[year, None if pd.isna(did) else did] for did in dids.astype(object)]
+    return {"stage": stage, "year": year, "touched": touched}
+
+
+def load_year(stage: str, year: int, touched: list | None, db_path: Path = PATH_DB) -> int:
+    '''
+    Function to replace one year of a table with its clean partition and to
+    refresh the summary partitions it touched, in a single transaction, so
+    running it again leaves the database unchanged
+
+    Args:
+        - stage: name of the table
+        - year: year of the partition
+        - touched: list of (year, did) summary partitions from clean_year,
+          None for every district of the year
+        - db_path: Path object of the database
+
+    Returns: number of rows of the year
+    '''
+    df = pd.DataFrame()
+    if year in clean_years(stage):
+        df = data_to_db.sql_values(cleaning.read_clean(stage, years=[year]))
+
+    with metrics.track(f"load.{stage}.{year}", rows_in=len(df)) as record:
+        with sqlite3.connect(db_path, timeout=DB_TIMEOUT) as con:
+            columns = data_to_db.table_info(con, stage)[0]
+            con.execute(f"DELETE FROM {stage} WHERE year = ?", (year,))
+            if len(df):
+                df.columns = columns
+                rows = df.astype(object).where(df.notna(), None).values.tolist()
+                con.executemany(f"INSERT INTO {stage} VALUES ({'?,' * (len(columns) - 1)}?)", rows)
+            if touched is None:
+                summary = data_to_db.SUMMARY_TABLES[stage][0]
+                touched = con.execute(f"""SELECT year, did FROM {stage} WHERE year = ?
+                                          UNION SELECT year, did FROM {summary} WHERE year = ?""",
+                                      (year, year)).fetchall()
+            data_to_db.refresh_summary(con, stage, [tuple(p) for p in touched])
+            data_to_db.record_watermark(con, stage, len(df))
+        record["rows_out"] = len(df)
+    return len(df)
+
+
+def commit(stages: list | None = None, db_path: Path = PATH_DB, compact: bool = False) -> dict:
+    '''
+    Function to close the run once every year is loaded: the pending
+    snapshots become the previous drop of the next run, the manifest
+    records the current inputs and the load is recorded as complete, so the
+    dashboard picks up the new data. A source without a plan is left as it
+    is. Every source in delta.DELTA_STAGES is closed unless stages is given.
+
+    Returns: dict with the number of new, changed and deleted records of each
+    source
+    '''
+    if stages is None:
+        stages = delta.DELTA_STAGES
+    stats, planned_at = {}, []
+    for stage in stages:
+        if not pending_path(stage, "plan.json").exists():
+            continue
+        with open(pending_path(stage, "plan.json")) as f:
+            plan_info = json.load(f)
+        stats[stage] = plan_info["stats"]
+        planned_at.append(plan_info["planned_at"])
+        delta.write_snapshot(pd.read_parquet(pending_path(stage, "rows.parquet")), stage)
+        shutil.rmtree(pending_path(stage, ""))
+
+    delta.update_manifest([*stats, "itis"] if "iti_enrollments" in stats else list(stats), compact)
+    if stats:
+        with sqlite3.connect(db_path, timeout=DB_TIMEOUT) as con:
+            # Rows written by the year tasks of this run
+            rows_written = con.execute(f"""SELECT COALESCE(SUM(rows_written), 0) FROM load_watermark
+                                           WHERE table_name IN ({', '.join('?' * len(stats))})
+                                           AND loaded_at >= ?""", (*stats, min(planned_at))).fetchone()[0]
+            if rows_written:
+                data_to_db.record_load_complete(con, rows_written)
+    delta.PATH_DELTA_STATS.parent.mkdir(parents=True, exist_ok=True)
+    with open(delta.PATH_DELTA_STATS, "w") as f:
+        json.dump({"computed_at": time.time(), "sources": stats}, f, indent=2)
+    return stats
+
+
+def main(db_path: Path = PATH_DB, compact: bool = False) -> dict:
+    '''
+    Function to run the partitioned delta in one process, one year after the
+    other: the same steps the Airflow DAG runs as parallel tasks
+
+    Returns: dict with the stats of each source
+    '''
+    prepare(db_path, compact)
+    for stage in delta.DELTA_STAGES:
+        for year in plan(stage, db_path, compact)["years"]:
+            load_year(**clean_year(stage, year, compact), db_path=db_path)
+    return commit(db_path=db_path, compact=compact)
+
+
+if __name__ == "__main__":
+    print(main())
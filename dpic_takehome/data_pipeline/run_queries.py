@@ -1,7 +1,17 @@
+import os
 import sqlite3
 import re
+import hashlib
+import tempfile
+import sys
+import json
+import queue
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
+from .. import metrics
 
 def read_queries(path: Path):
     with open(path, 'r') as q:
@@ -14,16 +24,221 @@ def read_queries(path: Path):
     query_dict = {title.strip(): query.strip()[len(title)+1:] for title, query in zip(headers, queries)}
     return query_dict
 
-def run_queries(db_path = Path('data/dpic.db'), query_file = Path('dpic_takehome/sql/queries.sql')):
-    con = sqlite3.connect(db_path)
+PATH_QUERY_CACHE = Path('data/cache/queries')
+# Name of the load_watermark rows written when a whole load finishes
+LOAD_COMPLETE = 'load_complete'
+
+query_timings = {}
+
+def timed_query(query: str, con: sqlite3.Connection, name: str = 'query') -> tuple[pd.DataFrame, float]:
+    '''
+    Helper function to run a query and measure how long it took in seconds.
+    It is also recorded in metrics as 'query.<name>'.
+    '''
+    with metrics.track(f'query.{name}', interval=None) as record:
+        df = pd.read_sql_query(query, con)
+        record['rows_out'] = len(df)
+    return df, record['seconds']
+
+def open_read_pool(db_path: Path, size: int) -> queue.Queue:
+    '''
+    Helper function to open a pool of read-only connections that can be shared
+    between threads. The journal mode is left to the loader (see
+    data_to_db.create_data_model).
+    '''
+    from .data_to_db import add_summary_fallbacks
+
+    pool = queue.Queue()
+    for _ in range(size):
+        con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+        add_summary_fallbacks(con)
+        pool.put(con)
+    return pool
+
+def db_version(db_path: Path) -> str:
+    '''
+    Helper function to get a token that changes whenever a load of the
+    database finishes: the number and time of the completed loads in
+    load_watermark, or the file modification time for databases created
+    before that table existed
+    '''
+    with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as con:
+        try:
+            n_loads, last_load = con.execute('''SELECT COUNT(*), MAX(loaded_at) FROM load_watermark
+                                                WHERE table_name = ?''', (LOAD_COMPLETE,)).fetchone()
+            return f'{n_loads}-{last_load}'
+        except sqlite3.OperationalError:
+            return str(os.path.getmtime(db_path))
+
+def cache_path(query: str, version: str, cache_dir = PATH_QUERY_CACHE) -> Path:
+    '''
+    Helper function to get the cache file of a query result, keyed on the hash
+    of the query text and the database version
+    '''
+    key = hashlib.sha256(f'{version}\n{query}'.encode()).hexdigest()[:24]
+    return cache_dir / f'{key}.feather'
+
+def read_cached(path: Path) -> pd.DataFrame | None:
+    '''
+    Helper function to memory-map a cached query result. Reading it marks the
+    file as recently used. A file evicted or replaced by another process while
+    it is read counts as a cache miss.
+    '''
+    import pyarrow as pa
+    from pyarrow import feather
+
+    try:
+        os.utime(path)
+        return feather.read_table(path, memory_map=True).to_pandas()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+def write_cached(path: Path, df: pd.DataFrame, max_entries = 64):
+    '''
+    Helper function to save a query result in the cache, evicting the least
+    recently used files beyond max_entries. The file is written under a
+    temporary name and swapped in, so other processes never read it half written.
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False) as f:
+        df.to_feather(f, compression='uncompressed')
+    os.replace(f.name, path)
+
+    cached = []
+    for file in path.parent.glob('*.feather'):
+        try:
+            cached.append((file.stat().st_mtime, file))
+        except FileNotFoundError:
+            continue
+    for _, file in sorted(cached, reverse=True)[max_entries:]:
+        file.unlink(missing_ok=True)
+
+def execute_queries(queries: dict, db_path: Path, parallel = False, max_workers = 4) -> dict:
+    '''
+    Helper function to run a dict of named queries, one after another or
+    concurrently over a pool of read-only connections. Summary tables missing
+    from an older database are computed on each connection (see
+    data_to_db.add_summary_fallbacks).
+
+    Returns: dict with the title, the result and the seconds of each query
+    '''
+    if not queries:
+        return {}
+
+    if parallel:
+        pool = open_read_pool(db_path, min(max_workers, len(queries)))
+
+        def run_pooled(table, query):
+            con = pool.get()
+            try:
+                return timed_query(query, con, table)
+            finally:
+                pool.put(con)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(queries, executor.map(run_pooled, queries, queries.values())))
+        while not pool.empty():
+            pool.get().close()
+    else:
+        from .data_to_db import add_summary_fallbacks
+
+        con = sqlite3.connect(db_path)
+        add_summary_fallbacks(con)
+        results = {table: timed_query(query, con, table) for table, query in queries.items()}
+        con.close()
+    return results
+
+def run_queries(db_path = Path('data/dpic.db'), query_file = Path('dpic_takehome/sql/queries.sql'),
+                parallel = False, max_workers = 4, cache = False):
+    '''
+    Function to run the named queries of the dashboard. With parallel=True the
+    queries run concurrently over a pool of read-only connections. With
+    cache=True results saved for the same query text and database version are
+    read from PATH_QUERY_CACHE instead of running the SQL. The seconds taken by
+    each query that ran are saved in query_timings.
+
+    Returns: dict with the title and the result of each query, in file order
+    '''
     queries = read_queries(query_file)
 
     result_tables = {}
-    for table, query in queries.items():
-        df = pd.read_sql_query(query, con)
+    if cache:
+        version = db_version(db_path)
+        for table, query in queries.items():
+            df = read_cached(cache_path(query, version))
+            if df is not None:
+                result_tables[table] = df
+
+    pending = {table: query for table, query in queries.items() if table not in result_tables}
+    for table, (df, seconds) in execute_queries(pending, db_path, parallel, max_workers).items():
         result_tables[table] = df
+        query_timings[table] = seconds
+        if cache:
+            write_cached(cache_path(queries[table], version), df)
+
+    return {table: result_tables[table] for table in queries}
+
+def explain_query(con: sqlite3.Connection, query: str) -> list:
+    '''
+    Helper function to get the steps of the query plan chosen by SQLite
+    '''
+    return [row[3] for row in con.execute(f'EXPLAIN QUERY PLAN {query}')]
+
+def plan_issues(plan: list) -> list:
+    '''
+    Helper function to keep the steps of a query plan that do not use an index:
+    full scans and temporary B-trees
+    '''
+    return [step for step in plan
+            if step.startswith('USE TEMP B-TREE') or (step.startswith('SCAN ') and 'INDEX' not in step)]
+
+def check_query_plans(db_path = Path('data/dpic.db'), query_file = Path('dpic_takehome/sql/queries.sql'),
+                      plans_file = Path('dpic_takehome/sql/query_plans.json'), update = False) -> dict:
+    '''
+    Function to compare the query plan of each named query with the accepted
+    plans in plans_file. Scans of CTEs and sorts on computed columns cannot use
+    an index, so they are accepted once recorded there; any new full scan or
+    temporary B-tree is reported as a regression.
+
+    Args:
+        - db_path: Path object of the database
+        - query_file: Path object of the queries
+        - plans_file: Path object of the accepted plan issues per query
+        - update: if True, records the current plans as the accepted ones
+
+    Returns: dict with the unexpected plan steps of each regressed query
+    '''
+    con = sqlite3.connect(db_path)
+    issues = {title: plan_issues(explain_query(con, query))
+              for title, query in read_queries(query_file).items()}
     con.close()
-    return result_tables
+
+    if update:
+        with open(plans_file, 'w') as f:
+            json.dump(issues, f, indent=2)
+        return {}
+
+    with open(plans_file, 'r') as f:
+        accepted = json.load(f)
+    regressions = {}
+    for title, steps in issues.items():
+        new_steps = Counter(steps) - Counter(accepted.get(title, []))
+        if new_steps:
+            regressions[title] = list(new_steps.elements())
+    return regressions
 
 if __name__ == "__main__":
-    run_queries()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check-plans', action='store_true', help='fail if a query plan regressed')
+    parser.add_argument('--update-plans', action='store_true', help='accept the current query plans')
+    args = parser.parse_args()
+
+    if args.update_plans:
+        check_query_plans(update=True)
+    elif args.check_plans:
+        regressions = check_query_plans()
+        for title, steps in regressions.items():
+            print(f'{title}: {", ".join(steps)}')
+        sys.exit(1 if regressions else 0)
+    else:
+        run_queries()
\ No newline at end of file
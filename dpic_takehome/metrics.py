@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+PATH_METRICS = Path("data/metrics/metrics.jsonl")
+# Size at which the export file is rotated: the full file is kept as
+# metrics.jsonl.1 (replacing the previous one) and a new file is started.
+# read_jsonl reads both.
+MAX_EXPORT_BYTES = 10 * 2**20
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MAX_RECORDS = 1000
+
+# Set to None to keep the records in memory only
+export_path = PATH_METRICS
+
+_records = deque(maxlen=MAX_RECORDS)
+_histograms = {}
+_lock = threading.Lock()
+_current = contextvars.ContextVar("current_record", default=None)
+
+
+def current_rss() -> int:
+    '''
+    Helper function to get the resident memory of the process in bytes
+    (Linux), its peak so far on other Unix systems, or 0 where neither is
+    available (e.g. Windows)
+    '''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+@contextmanager
+def measure(interval: float | None = 0.01):
+    '''
+    Context manager to time a block and keep the peak resident memory of the
+    process while it runs, sampled every `interval` seconds by a background
+    thread. With interval=None memory is only read at the start and the end,
+    which is cheap enough for short blocks like a single query.
+
+    Yields: dict filled with seconds, peak_rss_mb and rss_growth_mb on exit
+    '''
+    result = {}
+    start_rss = peak = current_rss()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, current_rss())
+
+    sampler = None
+    if interval is not None:
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = round(time.perf_counter() - start, 4)
+        if sampler is not None:
+            done.set()
+            sampler.join()
+        peak = max(peak, current_rss())
+        result["peak_rss_mb"] = round(peak / 2**20, 1)
+        result["rss_growth_mb"] = round((peak - start_rss) / 2**20, 1)
+
+
+@contextmanager
+def track(name: str, rows_in: int | None = None, interval: float | None = 0.01):
+    '''
+    Context manager to record a stage: wall time, peak memory and rows in/out.
+    The block can set record["rows_out"] (or rows_in), and functions called
+    inside it can count rows with add(). The record is kept in memory,
+    added to the latency histogram of `name` and appended to export_path.
+
+    Args:
+        - name: name of the stage (e.g. 'clean.grievances', 'query.<title>')
+        - rows_in: number of rows the stage reads, if known beforehand
+        - interval: seconds between memory samples, None for start and end only
+
+    Yields: dict with the record
+    '''
+    record = {"name": name, "rows_in": rows_in, "rows_out": None, "ok": True}
+    token = _current.set(record)
+    try:
+        with measure(interval) as m:
+            yield record
+    except BaseException:
+        record["ok"] = False
+        raise
+    finally:
+        _current.reset(token)
+        record.update(m, finished_at=round(time.time(), 3))
+        save(record)
+
+
+def add(key: str, n: int):
+    '''
+    Helper function to add n to a counter (e.g. rows_in) of the stage being
+    tracked in this thread, if any
+    '''
+    record = _current.get()
+    if record is not None:
+        record[key] = (record.get(key) or 0) + n
+
+
+def observe(name: str, seconds: float):
+    '''
+    Function to add a latency to the histogram of `name`
+    '''
+    with _lock:
+        histogram = _histograms.setdefault(name, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        ix = bisect_left(BUCKETS, seconds)
+        if ix < len(BUCKETS):
+            histogram["buckets"][ix] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+def rotated_path(path: Path) -> Path:
+    '''
+    Helper function to get where the previous export file is kept
+    '''
+    return path.with_name(path.name + ".1")
+
+
+def save(record: dict):
+    '''
+    Helper function to keep a finished record and append it to export_path
+    as a JSON line. Once the file reaches MAX_EXPORT_BYTES it is rotated, so
+    at most two files are kept on disk.
+    '''
+    observe(record["name"], record["seconds"])
+    with _lock:
+        _records.append(record)
+        if export_path is not None:
+            export_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                if export_path.stat().st_size >= MAX_EXPORT_BYTES:
+                    os.replace(export_path, rotated_path(export_path))
+            except FileNotFoundError:
+                # No file yet, or another process rotated it first
+                pass
+            with open(export_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+def records(prefix: str = "") -> list:
+    '''
+    Function to get the records kept in memory, optionally only the ones
+    whose name starts with prefix
+    '''
+    with _lock:
+        return [dict(r) for r in _records if r["name"].startswith(prefix)]
+
+
+def label(name: str) -> str:
+    '''
+    Helper function to escape a name for a Prometheus label value
+    '''
+    return name.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    '''
+    Function to export the metrics in the Prometheus text format: one latency
+    histogram per name, and the rows and peak memory of the last record of
+    each name
+
+    Returns: str with the exposition
+    '''
+    with _lock:
+        histograms = {name: dict(h, buckets=list(h["buckets"])) for name, h in _histograms.items()}
+        last = {r["name"]: r for r in _records}
+
+    lines = ["# HELP dpic_duration_seconds Wall time of pipeline stages, queries and callbacks",
+             "# TYPE dpic_duration_seconds histogram"]
+    for name, h in sorted(histograms.items()):
+        cumulative = 0
+        for le, count in zip(BUCKETS, h["buckets"]):
+            cumulative += count
+            lines.append(f'dpic_duration_seconds_bucket{{name="{label(name)}",le="{le}"}} {cumulative}')
+        lines.append(f'dpic_duration_seconds_bucket{{name="{label(name)}",le="+Inf"}} {h["count"]}')
+        lines.append(f'dpic_duration_seconds_sum{{name="{label(name)}"}} {h["sum"]:.6f}')
+        lines.append(f'dpic_duration_seconds_count{{name="{label(name)}"}} {h["count"]}')
+
+    for metric, key, help_text in [("dpic_rows_in", "rows_in", "Rows read by the last run"),
+                                   ("dpic_rows_out", "rows_out", "Rows produced by the last run"),
+                                   ("dpic_peak_rss_megabytes", "peak_rss_mb", "Peak resident memory during the last run")]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        lines += [f'{metric}{{name="{label(name)}"}} {r[key]}' for name, r in sorted(last.items()) if r.get(key) is not None]
+    return "\n".join(lines) + "\n"
+
+
+def read_jsonl(path: Path = PATH_METRICS) -> list:
+    '''
+    Helper function to read the records exported to a JSON lines file,
+    oldest first, including the file it was last rotated to
+    '''
+    rows = []
+    for file in [rotated_path(path), path]:
+        if file.exists():
+            with open(file) as f:
+                rows += [json.loads(line) for line in f if line.strip()]
+    return rows
+
+
+def hot_spots(rows: list, top: int = 10) -> list:
+    '''
+    Function to rank names by total time spent, to find where time goes
+    without a profiler
+
+    Returns: list of dicts with the count, total, median and max seconds and
+    the max peak memory of each name
+    '''
+    by_name = {}
+    for r in rows:
+        by_name.setdefault(r["name"], []).append(r)
+
+    summary = []
+    for name, group in by_name.items():
+        seconds = sorted(r["seconds"] for r in group)
+        summary.append({
+            "name": name,
+            "count": len(group),
+            "total_seconds": round(sum(seconds), 4),
+            "median_seconds": seconds[len(seconds) // 2],
+            "max_seconds": seconds[-1],
+            "max_peak_rss_mb": max(r["peak_rss_mb"] for r in group),
+        })
+    return sorted(summary, key=lambda s: s["total_seconds"], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show where the pipeline spends its time")
+    parser.add_argument("--path", type=Path, default=PATH_METRICS)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'name':<40} {'count':>6} {'total s':>9} {'median s':>9} {'max s':>9} {'peak MB':>9}")
+    for s in hot_spots(read_jsonl(args.path), args.top):
+        print(f"{s['name']:<40} {s['count']:>6} {s['total_seconds']:>9.3f} {s['median_seconds']:>9.3f} "
+              f"{s['max_seconds']:>9.3f} {s['max_peak_rss_mb']:>9.1f}")
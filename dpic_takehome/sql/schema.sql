@@ -1,6 +1,6 @@
 -- Table: districts
 DROP TABLE IF EXISTS districts;
-CREATE TABLE districts(
+CREATE TABLE IF NOT EXISTS districts(
     did char(4),
     name varchar(30),
     primary key (did)
@@ -8,7 +8,7 @@ CREATE TABLE districts(
 
 -- Table: itis
 DROP TABLE IF EXISTS itis;
-CREATE TABLE itis(
+CREATE TABLE IF NOT EXISTS itis(
     iid char(4),
     name varchar(30),
     primary key (iid)
@@ -16,7 +16,7 @@ CREATE TABLE itis(
 
 -- Table: grievances
 DROP TABLE IF EXISTS grievances;
-CREATE TABLE grievances(
+CREATE TABLE IF NOT EXISTS grievances(
     district_name varchar(30),
     submission_date date,
     grievance_text text,
@@ -31,7 +31,7 @@ CREATE TABLE grievances(
 
 -- Table: iti_enrollment
 DROP TABLE IF EXISTS iti_enrollments;
-CREATE TABLE iti_enrollments(
+CREATE TABLE IF NOT EXISTS iti_enrollments(
     year int,
     district varchar(30),
     institute_name text,
@@ -43,4 +43,45 @@ CREATE TABLE iti_enrollments(
     primary key (year, district, institute_name, program, gender),
     foreign key (did) references districts,
     foreign key (iid) references itis
-    );
\ No newline at end of file
+    );
+-- Table: enrollment_summary (maintained by data_to_db.refresh_summary)
+DROP TABLE IF EXISTS enrollment_summary;
+CREATE TABLE IF NOT EXISTS enrollment_summary(
+    year int,
+    did char(4),
+    district varchar(30),
+    program text,
+    gender varchar(6),
+    enrollment float,
+    primary key (year, did, district, program, gender)
+    );
+
+-- Table: grievance_summary (maintained by data_to_db.refresh_summary)
+DROP TABLE IF EXISTS grievance_summary;
+CREATE TABLE IF NOT EXISTS grievance_summary(
+    year int,
+    did char(4),
+    district_name varchar(30),
+    cat_grivance text,
+    num_grievances int,
+    primary key (year, did, district_name, cat_grivance)
+    );
+
+-- Indexes: built around the queries in queries.sql and the partition refresh
+-- of the summary tables. Checked by run_queries.check_query_plans
+CREATE INDEX IF NOT EXISTS idx_grievances_year_did ON grievances(year, did);
+CREATE INDEX IF NOT EXISTS idx_iti_enrollments_year_did ON iti_enrollments(year, did);
+CREATE INDEX IF NOT EXISTS idx_enrollment_summary_year_gender ON enrollment_summary(year, gender, enrollment);
+CREATE INDEX IF NOT EXISTS idx_enrollment_summary_district ON enrollment_summary(did, district, year, enrollment);
+CREATE INDEX IF NOT EXISTS idx_enrollment_summary_program ON enrollment_summary(year, district, program, enrollment);
+CREATE INDEX IF NOT EXISTS idx_grievance_summary_year_cat ON grievance_summary(year, cat_grivance, num_grievances);
+CREATE INDEX IF NOT EXISTS idx_grievance_summary_year_district ON grievance_summary(year, did, district_name, cat_grivance, num_grievances);
+CREATE INDEX IF NOT EXISTS idx_grievance_summary_district ON grievance_summary(did, district_name, num_grievances);
+
+-- Table: load_watermark (kept across reloads)
+CREATE TABLE IF NOT EXISTS load_watermark(
+    table_name varchar(30),
+    loaded_at float,
+    rows_written int,
+    rows_total int
+    );